@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed);
+CREATE TABLE IF NOT EXISTS activities (
+    activity_id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs (hash),
+    name TEXT,
+    type TEXT
+);
+"""
+
+
+class ActivityCache:
+    """On-disk cache of downloaded activity FIT files
+
+    FIT payloads are stored once per content hash in a directory sharded
+    by the first two hex digits of the hash, with an SQLite index mapping
+    activity ids to the payload, name and type. When the payloads exceed
+    max_size bytes the least recently used ones are evicted. The cache
+    can be shared between threads."""
+
+    def __init__(self, path, max_size=1 << 30):
+        self._path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(path, "index.db"), check_same_thread=False
+        )
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self._path, digest[:2], digest[2:] + ".fit")
+
+    def __contains__(self, activity_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM activities WHERE activity_id = ?", (activity_id,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, activity_id):
+        """(name, type, open FIT file) of a cached activity or None"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT hash, name, type FROM activities WHERE activity_id = ?",
+                (activity_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            digest, name, activity_type = row
+            self._conn.execute(
+                "UPDATE blobs SET accessed = ? WHERE hash = ?", (time.time(), digest)
+            )
+
+        try:
+            return name, activity_type, open(self._blob_path(digest), "rb")
+        except FileNotFoundError:
+            logger.warning("Cached FIT file of {} is missing".format(activity_id))
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM activities WHERE hash = ?", (digest,))
+                self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            return None
+
+    def put(self, activity_id, name, activity_type, data):
+        """Store the FIT payload of an activity, return its content hash"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write then rename so a crash never leaves a partial payload
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)",
+                (digest, len(data), time.time()),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO activities VALUES (?, ?, ?, ?)",
+                (activity_id, digest, name, activity_type),
+            )
+            self._evict()
+
+        return digest
+
+    def size(self):
+        with self._lock:
+            (size,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+        return size
+
+    def _evict(self):
+        """Remove least recently used payloads until within max_size"""
+        (size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        if size <= self.max_size:
+            return
+
+        rows = self._conn.execute(
+            "SELECT hash, size FROM blobs ORDER BY accessed"
+        ).fetchall()
+        for digest, blob_size in rows:
+            if size <= self.max_size:
+                break
+            self._conn.execute("DELETE FROM activities WHERE hash = ?", (digest,))
+            self._conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+            size -= blob_size
+            logger.debug("Evicted {} from the activity cache".format(digest))
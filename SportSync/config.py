@@ -0,0 +1,167 @@
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict
+
+import yaml
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .withings import WithingsCredentials
+
+logger = logging.getLogger(__name__)
+
+# Tag of the Withings credentials saved by the sync
+CREDENTIALS_TAG = (
+    "tag:yaml.org,2002:python/object:SportSync.withings.withings.WithingsCredentials"
+)
+
+
+# Use the libyaml bindings when they are available
+class Loader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    """Safe loader which also reads the Withings credentials"""
+
+
+class Dumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    """Safe dumper which also writes the Withings credentials"""
+
+
+def _construct_credentials(loader, node):
+    return WithingsCredentials(**loader.construct_mapping(node))
+
+
+def _represent_credentials(dumper, credentials):
+    return dumper.represent_mapping(CREDENTIALS_TAG, asdict(credentials))
+
+
+Loader.add_constructor(CREDENTIALS_TAG, _construct_credentials)
+Dumper.add_representer(WithingsCredentials, _represent_credentials)
+
+
+def _load(path):
+    with open(path) as c:
+        return yaml.load(c, Loader=Loader) or {}
+
+
+class _FileLock:
+    """Exclusive lock on path + ".lock", shared with other processes"""
+
+    def __init__(self, path):
+        self._path = path + ".lock"
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class ConfigStore:
+    """YAML config file, read once and written back atomically
+
+    Top level keys are sections. Sections set with store[name] = value,
+    or changed in place and flagged with mark_dirty(name), are written by
+    save(). Writes are coalesced: save() does nothing while no section is
+    dirty and otherwise writes all dirty sections at once. The file is
+    replaced through a temporary file and a rename under a lock, after
+    merging the dirty sections into the current file content so that
+    workers sharing the file do not overwrite each other's sections.
+
+    Use ConfigStore.open() to share one store per file between threads.
+    Used as a context manager the store is saved on exit."""
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, path="config.yml"):
+        self.path = os.path.abspath(path)
+        self._lock = threading.RLock()
+        self._data = _load(self.path)
+        self._dirty = set()
+
+    @classmethod
+    def open(cls, path="config.yml"):
+        """The shared store of path, loading it on first use"""
+        key = os.path.abspath(path)
+        with cls._stores_lock:
+            store = cls._stores.get(key)
+            if store is None:
+                store = cls._stores[key] = cls(key)
+            return store
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.save()
+
+    def __getitem__(self, section):
+        return self._data[section]
+
+    def __setitem__(self, section, value):
+        with self._lock:
+            self._data[section] = value
+            self._dirty.add(section)
+
+    def __contains__(self, section):
+        return section in self._data
+
+    def get(self, section, default=None):
+        return self._data.get(section, default)
+
+    def mark_dirty(self, section):
+        """Flag a section changed in place to be written by save()"""
+        with self._lock:
+            self._dirty.add(section)
+
+    @property
+    def dirty(self):
+        return frozenset(self._dirty)
+
+    def save(self):
+        """Write the dirty sections, returns False when there were none"""
+        with self._lock:
+            if not self._dirty:
+                return False
+
+            with _FileLock(self.path):
+                try:
+                    data = _load(self.path)
+                except FileNotFoundError:
+                    data = {}
+                for section in self._dirty:
+                    if section in self._data:
+                        data[section] = self._data[section]
+                self._write(data)
+
+            logger.debug(
+                "Saved {} to {}".format(", ".join(sorted(self._dirty)), self.path)
+            )
+            self._dirty.clear()
+            return True
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as outfile:
+                yaml.dump(data, outfile, Dumper=Dumper, default_flow_style=False)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            if os.path.exists(self.path):
+                os.chmod(tmp, os.stat(self.path).st_mode & 0o777)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
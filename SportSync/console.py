@@ -1,13 +1,115 @@
+import argparse
 import logging
+import signal
 import sys
-from .sync import withings_sync
+from threading import Event
+from .sync import withings_sync, sync_accounts
 
 
-def sync():
+def _logging():
     logging.basicConfig(
         stream=sys.stdout,
         level=logging.INFO,
         format="%(asctime)s %(levelname)s %(message)s",
     )
 
-    withings_sync()
+
+def sync(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["watch"]:
+        watch(argv[1:])
+        return
+
+    parser = argparse.ArgumentParser(description="Sync Withings to Garmin and Strava")
+    parser.add_argument(
+        "config",
+        nargs="*",
+        default=["config.yml"],
+        help="config file of each account to sync",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of accounts synced at once"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="upload even without new measurements"
+    )
+    args = parser.parse_args(argv)
+    _logging()
+
+    if len(args.config) == 1:
+        withings_sync(force=args.force, config_file=args.config[0])
+        return
+
+    results = sync_accounts(args.config, workers=args.workers, force=args.force)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+def watch(argv=None):
+    # Imported here so that one-shot runs do not pay for it
+    from .watch import watch as watch_accounts
+
+    parser = argparse.ArgumentParser(
+        prog="sportsync watch",
+        description="Keep syncing Withings to Garmin and Strava as measurements come",
+    )
+    parser.add_argument(
+        "config",
+        nargs="*",
+        default=["config.yml"],
+        help="config file of each account to sync",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of accounts polled at once"
+    )
+    parser.add_argument(
+        "--min-interval",
+        type=float,
+        default=60,
+        help="seconds between polls after a measurement",
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=900,
+        help="seconds between polls when idle",
+    )
+    parser.add_argument(
+        "--recent",
+        type=float,
+        default=3600,
+        help="poll at the shortest interval this long after a measurement",
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="[HOST:]PORT",
+        help="receive Withings notifications on this address",
+    )
+    parser.add_argument(
+        "--callback-url",
+        help="public URL of the notification receiver to subscribe the accounts to",
+    )
+    args = parser.parse_args(argv)
+    _logging()
+
+    listen = None
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        listen = (host, int(port))
+
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    try:
+        watch_accounts(
+            args.config,
+            workers=args.workers,
+            minimum=args.min_interval,
+            maximum=args.max_interval,
+            recent=args.recent,
+            stop=stop,
+            listen=listen,
+            callback_url=args.callback_url,
+        )
+    except KeyboardInterrupt:
+        pass
@@ -1,29 +1,47 @@
 from io import BytesIO
+from io import RawIOBase
+import mmap
+import os
+from struct import calcsize
 from struct import pack
-from struct import unpack
+from struct import Struct
+from struct import unpack_from
 from datetime import datetime
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from itertools import repeat
+from math import nan
 import time
 
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+_CRC_NIBBLE_TABLE = (
+    0x0000,
+    0xCC01,
+    0xD801,
+    0x1400,
+    0xF001,
+    0x3C00,
+    0x2800,
+    0xE401,
+    0xA001,
+    0x6C00,
+    0x7800,
+    0xB401,
+    0x5000,
+    0x9C01,
+    0x8801,
+    0x4400,
+)
+
 
 def _calcCRC(crc, byte):
-    table = [
-        0x0000,
-        0xCC01,
-        0xD801,
-        0x1400,
-        0xF001,
-        0x3C00,
-        0x2800,
-        0xE401,
-        0xA001,
-        0x6C00,
-        0x7800,
-        0xB401,
-        0x5000,
-        0x9C01,
-        0x8801,
-        0x4400,
-    ]
+    table = _CRC_NIBBLE_TABLE
     # compute checksum of lower four bits of byte
     tmp = table[crc & 0xF]
     crc = (crc >> 4) & 0x0FFF
@@ -35,6 +53,61 @@ def _calcCRC(crc, byte):
     return crc
 
 
+# Full byte table, entry n is the checksum of byte n starting from zero
+_CRC_TABLE = tuple(_calcCRC(0, n) for n in range(256))
+
+
+def crc16(data, initial=0):
+    """Compute the FIT CRC-16 of a bytes-like object
+
+    Pass the result of a previous call as initial to checksum
+    data in chunks."""
+    if not isinstance(data, (bytes, bytearray)):
+        data = memoryview(data).cast("B")
+    table = _CRC_TABLE
+    crc = initial
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _gf2_times(matrix, vec):
+    total = 0
+    n = 0
+    while vec:
+        if vec & 1:
+            total ^= matrix[n]
+        vec >>= 1
+        n += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, col) for col in matrix]
+
+
+def crc16_combine(crc1, crc2, len2):
+    """Combine two checksums
+
+    Given crc1 of block A and crc2 of block B (len2 bytes long) return
+    the checksum of A followed by B without touching the data
+    (see zlib crc32_combine)."""
+    if len2 <= 0:
+        return crc1
+
+    # operator for one zero byte, column n is the effect of bit n
+    odd = [(1 << n >> 8) ^ _CRC_TABLE[(1 << n) & 0xFF] for n in range(16)]
+
+    while len2:
+        if len2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        len2 >>= 1
+        if len2:
+            odd = _gf2_square(odd)
+
+    return crc1 ^ crc2
+
+
 class FitBaseType(object):
     """BaseType Definition
 
@@ -153,41 +226,203 @@ class FitBaseType(object):
         "size": 1,
     }  # array of byte, field is invalid if all bytes are invalid
 
+    _formats = {
+        0: "B",
+        1: "b",
+        2: "B",
+        3: "h",
+        4: "H",
+        5: "i",
+        6: "I",
+        7: "s",
+        8: "f",
+        9: "d",
+        10: "B",
+        11: "H",
+        12: "I",
+        13: "c",
+    }
+
+    _integer = (1, 2, 3, 4, 5, 6, 10, 11, 12)
+
     @staticmethod
     def get_format(basetype):
-        formats = {
-            0: "B",
-            1: "b",
-            2: "B",
-            3: "h",
-            4: "H",
-            5: "i",
-            6: "I",
-            7: "s",
-            8: "f",
-            9: "d",
-            10: "B",
-            11: "H",
-            12: "I",
-            13: "c",
-        }
-        return formats[basetype["#"]]
+        return FitBaseType._formats[basetype["#"]]
+
+    @staticmethod
+    def is_integer(basetype):
+        return basetype["#"] in FitBaseType._integer
 
     @staticmethod
     def pack(basetype, value):
         """function to avoid DeprecationWarning"""
-        if basetype["#"] in (1, 2, 3, 4, 5, 6, 10, 11, 12):
+        if FitBaseType.is_integer(basetype):
             value = int(value)
         fmt = FitBaseType.get_format(basetype)
         return pack(fmt, value)
 
 
+def _identity(value):
+    return value
+
+
+class FitMessageLayout(object):
+    """Compiled layout of a FIT message
+
+    fields is a sequence of (field number, name, basetype, scale) tuples. The
+    definition message content and a single little-endian Struct for the
+    data record (record header byte followed by the field values) are
+    built once so that writing a record is one pack call."""
+
+    def __init__(self, msg_number, fields):
+        self.msg_number = msg_number
+        self.fields = tuple(fields)
+
+        self.names = tuple(name for num, name, basetype, scale in self.fields)
+        self.basetypes = tuple(basetype for num, name, basetype, scale in self.fields)
+        self.scales = tuple(
+            1 if scale is None else scale for num, name, basetype, scale in self.fields
+        )
+        self.invalids = tuple(basetype["invalid"] for basetype in self.basetypes)
+
+        field_defs = [
+            pack("BBB", num, basetype["size"], basetype["field"])
+            for num, name, basetype, scale in self.fields
+        ]
+        # reserved, architecture(0: little endian)
+        self.definition = pack("<BBHB", 0, 0, msg_number, len(self.fields)) + b"".join(
+            field_defs
+        )
+
+        self.struct = Struct(
+            "<B" + "".join(FitBaseType.get_format(b) for b in self.basetypes)
+        )
+
+        self._converters = tuple(
+            (scale, invalid, int if FitBaseType.is_integer(basetype) else _identity)
+            for scale, invalid, basetype in zip(
+                self.scales, self.invalids, self.basetypes
+            )
+        )
+
+        # position of the timestamp field (253), None if there is none
+        self.timestamp_index = next(
+            (n for n, field in enumerate(self.fields) if field[0] == 253), None
+        )
+        self._compressed = None
+
+    @property
+    def compressed(self):
+        """Layout without the timestamp, for compressed timestamp headers"""
+        if self._compressed is None:
+            self._compressed = FitMessageLayout(
+                self.msg_number, [field for field in self.fields if field[0] != 253]
+            )
+        return self._compressed
+
+    def definition_record(self, lmsg_type):
+        """Definition message for this layout on local message lmsg_type"""
+        return pack("B", (1 << 6) + lmsg_type) + self.definition
+
+    def convert(self, values):
+        """Apply scale and invalid value substitution to values"""
+        return [
+            invalid if value is None else conv(value * scale)
+            for value, (scale, invalid, conv) in zip(values, self._converters)
+        ]
+
+    def data_record(self, lmsg_type, values):
+        """Data message for this layout on local message lmsg_type"""
+        return self.struct.pack(lmsg_type, *self.convert(values))
+
+
+# numpy equivalents of the struct formats used by the base types
+_NUMPY_FORMATS = {
+    "B": "u1",
+    "b": "i1",
+    "H": "u2",
+    "h": "i2",
+    "I": "u4",
+    "i": "i4",
+    "f": "f4",
+    "d": "f8",
+}
+
+
+def _slice(columns, start, stop):
+    return [None if col is None else col[start:stop] for col in columns]
+
+
+def _row(columns, row):
+    # value != value is only true for NaN
+    return [
+        None if col is None or col[row] != col[row] else col[row] for col in columns
+    ]
+
+
+def _pack_rows(parts, length):
+    """Pack rows of data records built from columns
+
+    parts is a sequence of (layout, lmsg_type, columns) where columns
+    holds one sequence (or None when the field is not set) per layout
+    field. Every row holds one data record for each part, in order."""
+    if np is not None:
+        return _pack_rows_numpy(parts, length)
+
+    row = Struct("<" + "".join(layout.struct.format[1:] for layout, _, _ in parts))
+    columns = []
+    for layout, lmsg_type, cols in parts:
+        columns.append(repeat(lmsg_type))
+        for col, converter in zip(cols, layout._converters):
+            columns.append(_convert_column(col, *converter))
+
+    return b"".join(row.pack(*values) for values in islice(zip(*columns), length))
+
+
+def _convert_column(col, scale, invalid, conv):
+    if col is None:
+        return repeat(invalid)
+    # value != value is only true for NaN
+    return (
+        invalid if value is None or value != value else conv(value * scale)
+        for value in col
+    )
+
+
+def _pack_rows_numpy(parts, length):
+    dtype = []
+    for n, (layout, _, _) in enumerate(parts):
+        dtype.append(("h{}".format(n), "u1"))
+        for m, basetype in enumerate(layout.basetypes):
+            fmt = _NUMPY_FORMATS[FitBaseType.get_format(basetype)]
+            dtype.append(("f{}_{}".format(n, m), "<" + fmt))
+
+    rows = np.empty(length, dtype=dtype)
+    for n, (layout, lmsg_type, cols) in enumerate(parts):
+        rows["h{}".format(n)] = lmsg_type
+        for m, (col, converter) in enumerate(zip(cols, layout._converters)):
+            scale, invalid, conv = converter
+            name = "f{}_{}".format(n, m)
+            if col is None:
+                rows[name] = invalid
+                continue
+            # None and NaN both mark a missing value
+            values = np.asarray(col, dtype=np.float64) * scale
+            if conv is int:
+                values = np.trunc(values)
+            rows[name] = np.where(np.isnan(values), invalid, values)
+
+    return rows.tobytes()
+
+
 class Fit(object):
     HEADER_SIZE = 12
 
     # not sure if this is the mesg_num
     GMSG_NUMS = {
         "file_id": 0,
+        "session": 18,
+        "record": 20,
         "device_info": 23,
         "weight_scale": 30,
         "file_creator": 49,
@@ -195,16 +430,183 @@ class Fit(object):
     }
 
 
+class FitSizeCounter(RawIOBase):
+    """Writable stream which only counts what is written to it
+
+    Used for the first pass when encoding to a stream that can not
+    seek, the second pass then writes the header from the size::
+
+        counter = FitEncoderWeight(FitSizeCounter())
+        ...
+        counter.finish()
+        fit = FitEncoderWeight(pipe, data_size=counter.data_size)
+        ...
+        fit.finish()
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pos = 0
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, b):
+        n = memoryview(b).nbytes
+        self._pos += n
+        self.size = max(self.size, self._pos)
+        return n
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            self._pos = self.size + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+# Messages the encoder can write: name -> (field number, name, basetype,
+# scale) of each field, in the order they are written
+ENCODER_PROFILE = {
+    "file_id": (
+        (3, "serial_number", FitBaseType.uint32z, None),
+        (4, "time_created", FitBaseType.uint32, None),
+        (1, "manufacturer", FitBaseType.uint16, None),
+        (2, "product", FitBaseType.uint16, None),
+        (5, "number", FitBaseType.uint16, None),
+        (0, "type", FitBaseType.enum, None),
+    ),
+    "file_creator": (
+        (0, "software_version", FitBaseType.uint16, None),
+        (1, "hardware_version", FitBaseType.uint8, None),
+    ),
+    "device_info": (
+        (253, "timestamp", FitBaseType.uint32, 1),
+        (3, "serial_number", FitBaseType.uint32z, 1),
+        (7, "cum_operating_time", FitBaseType.uint32, 1),
+        (8, None, FitBaseType.uint32, None),  # unknown field(undocumented)
+        (2, "manufacturer", FitBaseType.uint16, 1),
+        (4, "product", FitBaseType.uint16, 1),
+        (5, "software_version", FitBaseType.uint16, 100),
+        (10, "battery_voltage", FitBaseType.uint16, 256),
+        (0, "device_index", FitBaseType.uint8, 1),
+        (1, "device_type", FitBaseType.uint8, 1),
+        (6, "hardware_version", FitBaseType.uint8, 1),
+        (11, "battery_status", FitBaseType.uint8, None),
+    ),
+    "blood_pressure": (
+        (253, "timestamp", FitBaseType.uint32, 1),
+        (0, "systolic_blood_pressure", FitBaseType.uint16, 1),
+        (1, "diastolic_blood_pressure", FitBaseType.uint16, 1),
+        (2, "mean_arterial_pressure", FitBaseType.uint16, 1),
+        (3, "map_3_sample_mean", FitBaseType.uint16, 1),
+        (4, "map_morning_values", FitBaseType.uint16, 1),
+        (5, "map_evening_values", FitBaseType.uint16, 1),
+        (6, "heart_rate", FitBaseType.uint8, 1),
+    ),
+    "weight_scale": (
+        (253, "timestamp", FitBaseType.uint32, 1),
+        (0, "weight", FitBaseType.uint16, 100),
+        (1, "percent_fat", FitBaseType.uint16, 100),
+        (2, "percent_hydration", FitBaseType.uint16, 100),
+        (3, "visceral_fat_mass", FitBaseType.uint16, 100),
+        (4, "bone_mass", FitBaseType.uint16, 100),
+        (5, "muscle_mass", FitBaseType.uint16, 100),
+        (7, "basal_met", FitBaseType.uint16, 4),
+        (9, "active_met", FitBaseType.uint16, 4),
+        (8, "physique_rating", FitBaseType.uint8, 1),
+        (10, "metabolic_age", FitBaseType.uint8, 1),
+        (11, "visceral_fat_rating", FitBaseType.uint8, 1),
+        (13, "bmi", FitBaseType.uint16, 10),
+    ),
+}
+
+
+class FitLocalMessages(object):
+    """Allocation of the local message types of a FIT file to layouts
+
+    A definition message binds one of the 16 local message types to a
+    layout until the type is defined again. A new layout takes the lowest
+    free type and once they are all taken the least recently used one is
+    recycled, so a definition is only written again after eviction."""
+
+    SIZE = 16
+
+    def __init__(self, types=range(SIZE)):
+        # layout -> local message type, least recently used first
+        self._types = OrderedDict()
+        self._free = sorted(types, reverse=True)
+
+    def __contains__(self, layout):
+        return layout in self._types
+
+    def acquire(self, layout):
+        """(local message type, definition needed) for a record of layout"""
+        lmsg_type = self._types.get(layout)
+        if lmsg_type is not None:
+            self._types.move_to_end(layout)
+            return lmsg_type, False
+
+        if self._free:
+            lmsg_type = self._free.pop()
+        else:
+            _, lmsg_type = self._types.popitem(last=False)
+        self._types[layout] = lmsg_type
+        return lmsg_type, True
+
+
 class FitEncoder(Fit):
     FILE_TYPE = 9
-    LMSG_TYPE_FILE_INFO = 0
-    LMSG_TYPE_FILE_CREATOR = 1
-    LMSG_TYPE_DEVICE_INFO = 2
 
-    def __init__(self):
-        self.buf = BytesIO()
-        self.write_header()  # create header first
-        self.device_info_defined = False
+    LAYOUTS = {
+        name: FitMessageLayout(Fit.GMSG_NUMS[name], fields)
+        for name, fields in ENCODER_PROFILE.items()
+    }
+    FILE_INFO_LAYOUT = LAYOUTS["file_id"]
+    FILE_CREATOR_LAYOUT = LAYOUTS["file_creator"]
+    DEVICE_INFO_LAYOUT = LAYOUTS["device_info"]
+
+    def __init__(self, stream=None, data_size=None, compressed_timestamps=False):
+        """Create an encoder
+
+        By default the file is built in memory. Pass a writable binary
+        stream to encode directly into it. If the stream can seek the
+        header is patched on finish, otherwise the size of the data
+        (see FitSizeCounter) must be given as data_size up front.
+
+        With compressed_timestamps, records less than 32 s after the
+        previous timestamp use a compressed timestamp header and leave
+        the timestamp field out, saving 4 bytes each."""
+        if stream is None:
+            stream = BytesIO()
+        self.buf = stream
+        self._seekable = stream.seekable()
+        if not self._seekable and data_size is None:
+            raise ValueError("data_size is required for streams that can not seek")
+        self._start = stream.tell() if self._seekable else 0
+        self._expected_size = data_size
+        # running size and crc of everything after the header
+        self._data_size = 0
+        self._data_crc = 0
+        self._finished = False
+        self._compress = compressed_timestamps
+        self._last_timestamp = None
+        if compressed_timestamps:
+            # compressed timestamp headers only have local types 0 to 3
+            self._local = FitLocalMessages(range(4, FitLocalMessages.SIZE))
+            self._local_compressed = FitLocalMessages(range(4))
+        else:
+            self._local = FitLocalMessages()
+        self.write_header(data_size=data_size or 0)  # create header first
 
     def __str__(self):
         orig_pos = self.buf.tell()
@@ -226,7 +628,6 @@ class FitEncoder(Fit):
         data_size=0,
         data_type=b".FIT",
     ):
-        self.buf.seek(0)
         s = pack(
             "BBHI4s",
             header_size,
@@ -235,21 +636,76 @@ class FitEncoder(Fit):
             data_size,
             data_type,
         )
-        self.buf.write(s)
-
-    def _build_content_block(self, content):
-        field_defs = []
-        values = []
-        for num, basetype, value, scale in content:
-            s = pack("BBB", num, basetype["size"], basetype["field"])
-            field_defs.append(s)
-            if value is None:
-                # invalid value
-                value = basetype["invalid"]
-            elif scale is not None:
-                value *= scale
-            values.append(FitBaseType.pack(basetype, value))
-        return (b"".join(field_defs), b"".join(values))
+        if self._seekable:
+            self.buf.seek(self._start)
+            self.buf.write(s)
+            self.buf.seek(0, 2)
+        else:
+            self.buf.write(s)
+        self._header = s
+
+    def _write(self, data):
+        """Append data to the file updating the running crc"""
+        self.buf.write(data)
+        self._data_size += len(data)
+        self._data_crc = crc16(data, self._data_crc)
+
+    @classmethod
+    def register_message(cls, name, msg_number, fields):
+        """Add a message to those the encoder class can write
+
+        fields are (field number, name, basetype, scale) as in
+        ENCODER_PROFILE. The message is then written with write_message
+        and decoded by FitDecoder with its field names."""
+        cls.LAYOUTS = dict(cls.LAYOUTS)
+        cls.LAYOUTS[name] = FitMessageLayout(msg_number, fields)
+        FitDecoder.register_layout(name, cls.LAYOUTS[name])
+
+    def _write_message(self, layout, values):
+        """Write a data record, preceded by its definition if needed"""
+        if self._compress and layout.timestamp_index is not None:
+            timestamp = values[layout.timestamp_index]
+            if timestamp is not None:
+                timestamp = int(timestamp)
+                last, self._last_timestamp = self._last_timestamp, timestamp
+                if last is not None and 0 <= timestamp - last < 32:
+                    self._write_compressed(layout, values, timestamp)
+                    return
+
+        lmsg_type, define = self._local.acquire(layout)
+        record = layout.data_record(lmsg_type, values)
+        if define:
+            record = layout.definition_record(lmsg_type) + record
+        self._write(record)
+
+    def _write_compressed(self, layout, values, timestamp):
+        """Write a data record with a compressed timestamp header"""
+        index = layout.timestamp_index
+        layout = layout.compressed
+        lmsg_type, define = self._local_compressed.acquire(layout)
+        header = 0x80 | (lmsg_type << 5) | (timestamp & 0x1F)
+        record = layout.data_record(
+            header, list(values[:index]) + list(values[index + 1 :])
+        )
+        if define:
+            record = layout.definition_record(lmsg_type) + record
+        self._write(record)
+
+    def write_message(self, name, **values):
+        """Write a message of the profile given its field values
+
+        Fields not given are written as invalid, date and time fields
+        are converted from unix timestamps or datetimes."""
+        layout = self.LAYOUTS[name]
+        unknown = set(values).difference(layout.names)
+        if unknown:
+            raise TypeError(
+                "Unknown {} fields: {}".format(name, ", ".join(sorted(unknown)))
+            )
+        for field in _DATE_TIME_FIELDS:
+            if values.get(field) is not None:
+                values[field] = self.timestamp(values[field])
+        self._write_message(layout, [values.get(field) for field in layout.names])
 
     def write_file_info(
         self,
@@ -262,64 +718,19 @@ class FitEncoder(Fit):
         if time_created is None:
             time_created = datetime.now()
 
-        content = [
-            (3, FitBaseType.uint32z, serial_number, None),
-            (4, FitBaseType.uint32, self.timestamp(time_created), None),
-            (1, FitBaseType.uint16, manufacturer, None),
-            (2, FitBaseType.uint16, product, None),
-            (5, FitBaseType.uint16, number, None),
-            (0, FitBaseType.enum, self.FILE_TYPE, None),  # type
-        ]
-        fields, values = self._build_content_block(content)
-
-        # create fixed content
-        msg_number = self.GMSG_NUMS["file_id"]
-        fixed_content = pack(
-            "BBHB", 0, 0, msg_number, len(content)
-        )  # reserved, architecture(0: little endian)
-
-        self.buf.write(
-            b"".join(
-                [
-                    # definition
-                    self.record_header(
-                        definition=True, lmsg_type=self.LMSG_TYPE_FILE_INFO
-                    ),
-                    fixed_content,
-                    fields,
-                    # record
-                    self.record_header(lmsg_type=self.LMSG_TYPE_FILE_INFO),
-                    values,
-                ]
-            )
+        values = (
+            serial_number,
+            self.timestamp(time_created),
+            manufacturer,
+            product,
+            number,
+            self.FILE_TYPE,
         )
+        self._write_message(self.FILE_INFO_LAYOUT, values)
 
     def write_file_creator(self, software_version=None, hardware_version=None):
-        content = [
-            (0, FitBaseType.uint16, software_version, None),
-            (1, FitBaseType.uint8, hardware_version, None),
-        ]
-        fields, values = self._build_content_block(content)
-
-        msg_number = self.GMSG_NUMS["file_creator"]
-        fixed_content = pack(
-            "BBHB", 0, 0, msg_number, len(content)
-        )  # reserved, architecture(0: little endian)
-        self.buf.write(
-            b"".join(
-                [
-                    # definition
-                    self.record_header(
-                        definition=True, lmsg_type=self.LMSG_TYPE_FILE_CREATOR
-                    ),
-                    fixed_content,
-                    fields,
-                    # record
-                    self.record_header(lmsg_type=self.LMSG_TYPE_FILE_CREATOR),
-                    values,
-                ]
-            )
-        )
+        values = (software_version, hardware_version)
+        self._write_message(self.FILE_CREATOR_LAYOUT, values)
 
     def write_device_info(
         self,
@@ -335,35 +746,61 @@ class FitEncoder(Fit):
         hardware_version=None,
         battery_status=None,
     ):
-        content = [
-            (253, FitBaseType.uint32, self.timestamp(timestamp), 1),
-            (3, FitBaseType.uint32z, serial_number, 1),
-            (7, FitBaseType.uint32, cum_operationg_time, 1),
-            (8, FitBaseType.uint32, None, None),  # unknown field(undocumented)
-            (2, FitBaseType.uint16, manufacturer, 1),
-            (4, FitBaseType.uint16, product, 1),
-            (5, FitBaseType.uint16, software_version, 100),
-            (10, FitBaseType.uint16, battery_voltage, 256),
-            (0, FitBaseType.uint8, device_index, 1),
-            (1, FitBaseType.uint8, device_type, 1),
-            (6, FitBaseType.uint8, hardware_version, 1),
-            (11, FitBaseType.uint8, battery_status, None),
-        ]
-        fields, values = self._build_content_block(content)
+        values = (
+            self.timestamp(timestamp),
+            serial_number,
+            cum_operationg_time,
+            None,
+            manufacturer,
+            product,
+            software_version,
+            battery_voltage,
+            device_index,
+            device_type,
+            hardware_version,
+            battery_status,
+        )
+        self._write_message(self.DEVICE_INFO_LAYOUT, values)
 
-        if not self.device_info_defined:
-            header = self.record_header(
-                definition=True, lmsg_type=self.LMSG_TYPE_DEVICE_INFO
-            )
-            msg_number = self.GMSG_NUMS["device_info"]
-            fixed_content = pack(
-                "BBHB", 0, 0, msg_number, len(content)
-            )  # reserved, architecture(0: little endian)
-            self.buf.write(header + fixed_content + fields)
-            self.device_info_defined = True
+    def _write_batch(self, parts, length):
+        """Write rows of data records from columns (see _pack_rows)"""
+        self._write(_pack_rows(parts, length))
+
+    def _write_rows(self, parts, length):
+        """Write rows of data records from (layout, columns) parts
+
+        If a layout is not defined yet the first row is written record by
+        record so that definitions are in the same place as when writing
+        one record at a time, the other rows are packed at once."""
+        if self._compress:
+            # whether a record is compressed depends on the one before
+            for row in range(length):
+                for layout, cols in parts:
+                    self._write_message(layout, _row(cols, row))
+            return
+
+        first = 0
+        if not all(layout in self._local for layout, cols in parts):
+            for layout, cols in parts:
+                lmsg_type, define = self._local.acquire(layout)
+                if define:
+                    self._write(layout.definition_record(lmsg_type))
+                self._write_batch([(layout, lmsg_type, _slice(cols, 0, 1))], 1)
+            first = 1
 
-        header = self.record_header(lmsg_type=self.LMSG_TYPE_DEVICE_INFO)
-        self.buf.write(header + values)
+        if first < length:
+            # all the layouts are defined now, acquiring them evicts none
+            batch = []
+            for layout, cols in parts:
+                lmsg_type, _ = self._local.acquire(layout)
+                batch.append((layout, lmsg_type, _slice(cols, first, length)))
+            self._write_batch(batch, length - first)
+
+    def _timestamps(self, timestamps):
+        """Convert a column of unix timestamps to FIT timestamps"""
+        if np is not None:
+            return np.asarray(timestamps, dtype=np.float64) - 631065600
+        return [self.timestamp(t) for t in timestamps]
 
     def record_header(self, definition=False, lmsg_type=0):
         msg = 0
@@ -372,33 +809,34 @@ class FitEncoder(Fit):
         return pack("B", msg + lmsg_type)
 
     def crc(self):
-        orig_pos = self.buf.tell()
-        self.buf.seek(0)
-
-        crc = 0
-        while True:
-            b = self.buf.read(1)
-            if not b:
-                break
-            crc = _calcCRC(crc, unpack("b", b)[0])
-        self.buf.seek(orig_pos)
+        crc = crc16_combine(crc16(self._header), self._data_crc, self._data_size)
         return pack("H", crc)
 
     def finish(self):
         """re-weite file-header, then append crc to end of file"""
-        data_size = self.get_size() - self.HEADER_SIZE
-        self.write_header(data_size=data_size)
-        crc = self.crc()
-        self.buf.seek(0, 2)
-        self.buf.write(crc)
+        if self._seekable:
+            self.write_header(data_size=self._data_size)
+        elif self._data_size != self._expected_size:
+            raise ValueError(
+                "Wrote {} bytes of data, header has {}".format(
+                    self._data_size, self._expected_size
+                )
+            )
+        self.buf.write(self.crc())
+        self.buf.flush()
+        self._finished = True
 
     def get_size(self):
-        orig_pos = self.buf.tell()
-        self.buf.seek(0, 2)
-        size = self.buf.tell()
-        self.buf.seek(orig_pos)
+        size = len(self._header) + self._data_size
+        if self._finished:
+            size += 2
         return size
 
+    @property
+    def data_size(self):
+        """Number of bytes written after the header"""
+        return self._data_size
+
     def getvalue(self):
         return self.buf.getvalue()
 
@@ -411,12 +849,7 @@ class FitEncoder(Fit):
 
 
 class FitEncoderBloodPressure(FitEncoder):
-    # Here might be dragons - no idea what lsmg stand for, found 14 somewhere in the deepest web
-    LMSG_TYPE_BLOOD_PRESSURE = 14
-
-    def __init__(self):
-        super().__init__()
-        self.blood_pressure_monitor_defined = False
+    BLOOD_PRESSURE_LAYOUT = FitEncoder.LAYOUTS["blood_pressure"]
 
     def write_blood_pressure(
         self,
@@ -429,40 +862,21 @@ class FitEncoderBloodPressure(FitEncoder):
         map_evening_values=None,
         heart_rate=None,
     ):
-        # BLOOD PRESSURE FILE MESSAGES
-        content = [
-            (253, FitBaseType.uint32, self.timestamp(timestamp), 1),
-            (0, FitBaseType.uint16, systolic_blood_pressure, 1),
-            (1, FitBaseType.uint16, diastolic_blood_pressure, 1),
-            (2, FitBaseType.uint16, mean_arterial_pressure, 1),
-            (3, FitBaseType.uint16, map_3_sample_mean, 1),
-            (4, FitBaseType.uint16, map_morning_values, 1),
-            (5, FitBaseType.uint16, map_evening_values, 1),
-            (6, FitBaseType.uint8, heart_rate, 1),
-        ]
-        fields, values = self._build_content_block(content)
-
-        if not self.blood_pressure_monitor_defined:
-            header = self.record_header(
-                definition=True, lmsg_type=self.LMSG_TYPE_BLOOD_PRESSURE
-            )
-            msg_number = self.GMSG_NUMS["blood_pressure"]
-            fixed_content = pack(
-                "BBHB", 0, 0, msg_number, len(content)
-            )  # reserved, architecture(0: little endian)
-            self.buf.write(header + fixed_content + fields)
-            self.blood_pressure_monitor_defined = True
-
-        header = self.record_header(lmsg_type=self.LMSG_TYPE_BLOOD_PRESSURE)
-        self.buf.write(header + values)
+        values = (
+            self.timestamp(timestamp),
+            systolic_blood_pressure,
+            diastolic_blood_pressure,
+            mean_arterial_pressure,
+            map_3_sample_mean,
+            map_morning_values,
+            map_evening_values,
+            heart_rate,
+        )
+        self._write_message(self.BLOOD_PRESSURE_LAYOUT, values)
 
 
 class FitEncoderWeight(FitEncoder):
-    LMSG_TYPE_WEIGHT_SCALE = 3
-
-    def __init__(self):
-        super().__init__()
-        self.weight_scale_defined = False
+    WEIGHT_SCALE_LAYOUT = FitEncoder.LAYOUTS["weight_scale"]
 
     def write_weight_scale(
         self,
@@ -480,33 +894,575 @@ class FitEncoderWeight(FitEncoder):
         visceral_fat_rating=None,
         bmi=None,
     ):
-        content = [
-            (253, FitBaseType.uint32, self.timestamp(timestamp), 1),
-            (0, FitBaseType.uint16, weight, 100),
-            (1, FitBaseType.uint16, percent_fat, 100),
-            (2, FitBaseType.uint16, percent_hydration, 100),
-            (3, FitBaseType.uint16, visceral_fat_mass, 100),
-            (4, FitBaseType.uint16, bone_mass, 100),
-            (5, FitBaseType.uint16, muscle_mass, 100),
-            (7, FitBaseType.uint16, basal_met, 4),
-            (9, FitBaseType.uint16, active_met, 4),
-            (8, FitBaseType.uint8, physique_rating, 1),
-            (10, FitBaseType.uint8, metabolic_age, 1),
-            (11, FitBaseType.uint8, visceral_fat_rating, 1),
-            (13, FitBaseType.uint16, bmi, 10),
-        ]
-        fields, values = self._build_content_block(content)
+        values = (
+            self.timestamp(timestamp),
+            weight,
+            percent_fat,
+            percent_hydration,
+            visceral_fat_mass,
+            bone_mass,
+            muscle_mass,
+            basal_met,
+            active_met,
+            physique_rating,
+            metabolic_age,
+            visceral_fat_rating,
+            bmi,
+        )
+        self._write_message(self.WEIGHT_SCALE_LAYOUT, values)
+
+    def write_weight_scale_batch(
+        self,
+        timestamps,
+        weight,
+        percent_fat=None,
+        percent_hydration=None,
+        visceral_fat_mass=None,
+        bone_mass=None,
+        muscle_mass=None,
+        basal_met=None,
+        active_met=None,
+        physique_rating=None,
+        metabolic_age=None,
+        visceral_fat_rating=None,
+        bmi=None,
+        device_info=True,
+    ):
+        """Write weight scale records from columns of values
+
+        timestamps are unix timestamps, each other argument is a sequence
+        (or NumPy array) of the same length or None when not measured.
+        None or NaN entries are written as invalid values. If device_info
+        a device_info record is written before each weight scale record,
+        as a loop over write_device_info and write_weight_scale would."""
+        timestamps = self._timestamps(timestamps)
+        length = len(timestamps)
+        if not length:
+            return
+
+        columns = (
+            timestamps,
+            weight,
+            percent_fat,
+            percent_hydration,
+            visceral_fat_mass,
+            bone_mass,
+            muscle_mass,
+            basal_met,
+            active_met,
+            physique_rating,
+            metabolic_age,
+            visceral_fat_rating,
+            bmi,
+        )
+        for col in columns:
+            if col is not None and len(col) != length:
+                raise ValueError("All columns must have the same length")
+
+        parts = []
+        if device_info:
+            layout = self.DEVICE_INFO_LAYOUT
+            cols = (timestamps,) + (None,) * (len(layout.fields) - 1)
+            parts.append((layout, cols))
+        parts.append((self.WEIGHT_SCALE_LAYOUT, columns))
+        self._write_rows(parts, length)
+
+
+class FitDecodeError(Exception):
+    """Data is not a valid FIT file"""
+
+
+class FitCRCError(FitDecodeError):
+    """CRC of the FIT file does not match its contents"""
+
+
+class FitRecord(object):
+    """Decoded FIT data message
+
+    fields maps field names (or numbers for fields not in the profile)
+    to values, developer_fields maps (developer data index, field number)
+    to the raw bytes of developer fields."""
+
+    __slots__ = (
+        "global_msg",
+        "local_msg",
+        "name",
+        "timestamp",
+        "fields",
+        "developer_fields",
+    )
+
+    def __init__(self, global_msg, local_msg, name, fields, developer_fields=None):
+        self.global_msg = global_msg
+        self.local_msg = local_msg
+        self.name = name
+        self.fields = fields
+        self.developer_fields = developer_fields or {}
+        self.timestamp = fields.get("timestamp")
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def __repr__(self):
+        return "FitRecord({!r}, {!r})".format(
+            self.global_msg if self.name is None else self.name, self.fields
+        )
+
+
+# base types by number, the base type byte also carries an endian flag
+_BASE_TYPES = {
+    basetype["#"]: basetype
+    for basetype in (
+        FitBaseType.enum,
+        FitBaseType.sint8,
+        FitBaseType.uint8,
+        FitBaseType.sint16,
+        FitBaseType.uint16,
+        FitBaseType.sint32,
+        FitBaseType.uint32,
+        FitBaseType.string,
+        FitBaseType.float32,
+        FitBaseType.float64,
+        FitBaseType.uint8z,
+        FitBaseType.uint16z,
+        FitBaseType.uint32z,
+        FitBaseType.byte,
+    )
+}
+
+_KIND_INT = 0
+_KIND_FLOAT = 1
+_KIND_STRING = 2
+_KIND_BYTES = 3
+
+# the FIT epoch as a unix timestamp
+_FIT_EPOCH = 631065600
+
+# fields holding a FIT date_time, decoded as unix timestamps
+_DATE_TIME_FIELDS = ("timestamp", "time_created", "start_time")
+
 
-        if not self.weight_scale_defined:
-            header = self.record_header(
-                definition=True, lmsg_type=self.LMSG_TYPE_WEIGHT_SCALE
+def _decode_value(kind, raw, invalid, scale, offset, date_time):
+    if kind == _KIND_INT:
+        if raw == invalid:
+            return None
+        if date_time:
+            return raw + _FIT_EPOCH
+        if scale != 1 or offset:
+            return raw / scale - offset
+        return raw
+    if kind == _KIND_FLOAT:
+        # all ones (the invalid value) is a NaN
+        if raw != raw:
+            return None
+        if scale != 1 or offset:
+            return raw / scale - offset
+        return raw
+    if kind == _KIND_STRING:
+        raw = raw.split(b"\0", 1)[0]
+        return raw.decode("utf-8", errors="replace") if raw else None
+    if raw.count(0xFF) == len(raw):
+        return None
+    return raw
+
+
+class _FitDefinition(object):
+    """Compiled layout of a definition message"""
+
+    __slots__ = (
+        "global_msg",
+        "name",
+        "struct",
+        "fields",
+        "developer_fields",
+        "size",
+        "timestamp",
+    )
+
+    def __init__(self, global_msg, name, big_endian, fields, developer_fields, profile):
+        self.global_msg = global_msg
+        self.name = name
+
+        msg_profile = profile.get(global_msg, {})
+        fmt = [">" if big_endian else "<"]
+        specs = []
+        index = 0
+        # Struct and offset to read just the timestamp field
+        self.timestamp = None
+        for num, size, basetype in fields:
+            if num == 253 and size == 4:
+                self.timestamp = (
+                    Struct(fmt[0] + "I"),
+                    calcsize("".join(fmt)),
+                )
+            basetype = _BASE_TYPES.get(basetype & 0x1F, FitBaseType.byte)
+            base_fmt = FitBaseType.get_format(basetype)
+            base_size = calcsize(base_fmt)
+            if base_fmt in "sc" or size % base_size:
+                kind = _KIND_STRING if base_fmt == "s" else _KIND_BYTES
+                count = 1
+                fmt.append("{}s".format(size))
+            else:
+                kind = _KIND_FLOAT if base_fmt in "fd" else _KIND_INT
+                count = size // base_size
+                fmt.append("{}{}".format(count, base_fmt))
+
+            field_name, scale, offset = msg_profile.get(num, (None, 1, 0))
+            if num == 253:
+                field_name = "timestamp"
+            key = num if field_name is None else field_name
+            specs.append(
+                (
+                    key,
+                    index,
+                    count,
+                    kind,
+                    basetype["invalid"],
+                    scale,
+                    offset,
+                    key in _DATE_TIME_FIELDS,
+                )
+            )
+            index += count
+
+        self.struct = Struct("".join(fmt))
+        self.fields = tuple(specs)
+        self.developer_fields = tuple(
+            ((dev_index, num), size) for num, size, dev_index in developer_fields
+        )
+        self.size = self.struct.size + sum(size for _, size in self.developer_fields)
+
+    def decode(self, view, pos):
+        """Decode the data message content starting at pos"""
+        values = self.struct.unpack_from(view, pos)
+        fields = {}
+        for key, index, count, kind, invalid, scale, offset, date_time in self.fields:
+            if count == 1:
+                fields[key] = _decode_value(
+                    kind, values[index], invalid, scale, offset, date_time
+                )
+            else:
+                fields[key] = [
+                    _decode_value(kind, raw, invalid, scale, offset, date_time)
+                    for raw in values[index : index + count]
+                ]
+
+        developer_fields = {}
+        pos += self.struct.size
+        for key, size in self.developer_fields:
+            developer_fields[key] = bytes(view[pos : pos + size])
+            pos += size
+
+        return fields, developer_fields
+
+
+def _layout_profile(layout):
+    return (
+        layout.msg_number,
+        {
+            num: (name, 1 if scale is None else scale, 0)
+            for num, name, basetype, scale in layout.fields
+            if name is not None
+        },
+    )
+
+
+class FitDecoder(Fit):
+    """Decode FIT files
+
+    source is a bytes-like object (including mmap), a BytesIO, an open
+    binary file (read into memory) or the path of a file, which is memory
+    mapped. Data messages are decoded lazily
+    as FitRecord objects when iterating, with the struct layout compiled
+    once per distinct definition message. The file CRC is checked as the
+    records are read when check_crc is set."""
+
+    # global message number -> field number -> (name, scale, offset)
+    PROFILE = dict(_layout_profile(layout) for layout in FitEncoder.LAYOUTS.values())
+    PROFILE[Fit.GMSG_NUMS["session"]] = {
+        2: ("start_time", 1, 0),
+        7: ("total_elapsed_time", 1000, 0),
+        8: ("total_timer_time", 1000, 0),
+        9: ("total_distance", 100, 0),
+    }
+    PROFILE[Fit.GMSG_NUMS["record"]] = {
+        0: ("position_lat", 1, 0),
+        1: ("position_long", 1, 0),
+        2: ("altitude", 5, 500),
+        3: ("heart_rate", 1, 0),
+        4: ("cadence", 1, 0),
+        5: ("distance", 100, 0),
+        6: ("speed", 1000, 0),
+        7: ("power", 1, 0),
+        13: ("temperature", 1, 0),
+        73: ("enhanced_speed", 1000, 0),
+        78: ("enhanced_altitude", 5, 500),
+    }
+
+    MSG_NAMES = {num: name for name, num in Fit.GMSG_NUMS.items()}
+
+    @classmethod
+    def register_layout(cls, name, layout):
+        """Decode the messages of an encoder layout with its field names"""
+        msg_number, profile = _layout_profile(layout)
+        cls.PROFILE = dict(cls.PROFILE)
+        cls.PROFILE[msg_number] = profile
+        cls.MSG_NAMES = dict(cls.MSG_NAMES)
+        cls.MSG_NAMES[msg_number] = name
+
+    def __init__(self, source, check_crc=True):
+        self._file = None
+        self._mmap = None
+        self._buffer = None
+        if isinstance(source, (str, os.PathLike)):
+            self._file = open(source, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            source = self._mmap
+        elif hasattr(source, "getbuffer"):
+            source = self._buffer = source.getbuffer()
+        elif hasattr(source, "read"):
+            source = source.read()
+
+        self._view = memoryview(source)
+        self._check_crc = check_crc
+        self._definitions = dict()
+
+        (
+            self.header_size,
+            self.protocol_version,
+            self.profile_version,
+            self.data_size,
+        ) = self._read_header(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        self._view.release()
+        if self._buffer is not None:
+            self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+
+    def _read_header(self, pos):
+        if len(self._view) - pos < self.HEADER_SIZE:
+            raise FitDecodeError("File too short for a FIT header")
+        header_size, protocol_version, profile_version, data_size, data_type = (
+            unpack_from("<BBHI4s", self._view, pos)
+        )
+        if data_type != b".FIT" or header_size < self.HEADER_SIZE:
+            raise FitDecodeError("Not a FIT file")
+        if header_size >= 14 and self._check_crc:
+            (header_crc,) = unpack_from("<H", self._view, pos + 12)
+            if header_crc and header_crc != crc16(self._view[pos : pos + 12]):
+                raise FitCRCError("Header CRC does not match")
+        return header_size, protocol_version, profile_version, data_size
+
+    def _compile(self, content, big_endian, global_msg, fields, developer_fields):
+        """Compiled layout for definition message content, cached"""
+        definition = self._definitions.get(content)
+        if definition is None:
+            definition = _FitDefinition(
+                global_msg,
+                self.MSG_NAMES.get(global_msg),
+                big_endian,
+                fields,
+                developer_fields,
+                self.PROFILE,
+            )
+            self._definitions[content] = definition
+        return definition
+
+    def _read_definition(self, header, pos):
+        """Read the definition message at pos, return it and its end"""
+        view = self._view
+        big_endian = view[pos + 2] == 1
+        global_msg, num_fields = unpack_from(
+            ">HB" if big_endian else "<HB", view, pos + 3
+        )
+        end = pos + 6 + 3 * num_fields
+        fields = [tuple(view[n : n + 3]) for n in range(pos + 6, end, 3)]
+
+        developer_fields = []
+        if header & 0x20:
+            num_fields = view[end]
+            start = end + 1
+            end = start + 3 * num_fields
+            developer_fields = [tuple(view[n : n + 3]) for n in range(start, end, 3)]
+
+        content = bytes(view[pos + 1 : end])
+        definition = self._compile(
+            content, big_endian, global_msg, fields, developer_fields
+        )
+        return definition, end
+
+    def _walk(self, check_crc):
+        """Generator of (position, local message, definition, timestamp)
+
+        for each data message without decoding it. timestamp is set
+        for compressed timestamp headers only."""
+        view = self._view
+        pos = 0
+
+        # FIT files can be chained one after the other
+        while pos < len(view):
+            header_size, _, _, data_size = self._read_header(pos)
+            start = pos + header_size
+            end = start + data_size
+            if end + 2 > len(view):
+                raise FitDecodeError("File is truncated")
+
+            crc = crc16(view[pos:start]) if check_crc else 0
+            local_msgs = dict()
+            last_timestamp = None
+
+            pos = start
+            while pos < end:
+                header = view[pos]
+                timestamp = None
+                if header & 0x80:
+                    # compressed timestamp header
+                    local_msg = (header >> 5) & 0x03
+                    if last_timestamp is None:
+                        raise FitDecodeError("Compressed timestamp without timestamp")
+                    offset = header & 0x1F
+                    last_timestamp += (offset - (last_timestamp & 0x1F)) & 0x1F
+                    timestamp = last_timestamp
+                elif header & 0x40:
+                    definition, next_pos = self._read_definition(header, pos)
+                    local_msgs[header & 0x0F] = definition
+                    if check_crc:
+                        crc = crc16(view[pos:next_pos], crc)
+                    pos = next_pos
+                    continue
+                else:
+                    local_msg = header & 0x0F
+
+                definition = local_msgs.get(local_msg)
+                if definition is None:
+                    raise FitDecodeError(
+                        "Data message for undefined local message {}".format(local_msg)
+                    )
+
+                next_pos = pos + 1 + definition.size
+                if next_pos > end:
+                    raise FitDecodeError("File is truncated")
+
+                if timestamp is None and definition.timestamp is not None:
+                    ts_struct, ts_offset = definition.timestamp
+                    (raw,) = ts_struct.unpack_from(view, pos + 1 + ts_offset)
+                    if raw != 0xFFFFFFFF:
+                        last_timestamp = raw
+
+                if check_crc:
+                    crc = crc16(view[pos:next_pos], crc)
+
+                yield pos, local_msg, definition, timestamp
+                pos = next_pos
+
+            if check_crc:
+                (file_crc,) = unpack_from("<H", view, end)
+                if file_crc != crc:
+                    raise FitCRCError("File CRC does not match")
+            pos = end + 2
+
+    def records(self):
+        """Generator of the data messages in the file as FitRecord"""
+        view = self._view
+        for pos, local_msg, definition, timestamp in self._walk(self._check_crc):
+            fields, developer_fields = definition.decode(view, pos + 1)
+            if timestamp is not None:
+                # first, as in records with a timestamp field
+                fields.pop("timestamp", None)
+                fields = {"timestamp": timestamp + _FIT_EPOCH, **fields}
+
+            yield FitRecord(
+                definition.global_msg,
+                local_msg,
+                definition.name,
+                fields,
+                developer_fields,
             )
-            msg_number = self.GMSG_NUMS["weight_scale"]
-            fixed_content = pack(
-                "BBHB", 0, 0, msg_number, len(content)
-            )  # reserved, architecture(0: little endian)
-            self.buf.write(header + fixed_content + fields)
-            self.weight_scale_defined = True
-
-        header = self.record_header(lmsg_type=self.LMSG_TYPE_WEIGHT_SCALE)
-        self.buf.write(header + values)
+
+    def columns(self, global_msg, fields=None):
+        """Decode all data messages of one type into columns
+
+        global_msg is the global message number (e.g. 20 for record) or
+        name. Returns a NumPy structured array when NumPy is available,
+        otherwise a dict of array.array, with a column per scalar numeric
+        field (or just those named in fields). The timestamp column holds
+        unix timestamps (0 when missing), other columns are floats with
+        scale and offset applied (date_time fields as unix timestamps) and
+        NaN for invalid values."""
+        if isinstance(global_msg, str):
+            global_msg = self.GMSG_NUMS[global_msg]
+
+        # First pass finds the messages and the columns they hold
+        messages = []
+        names = dict()
+        for pos, _, definition, timestamp in self._walk(self._check_crc):
+            if definition.global_msg != global_msg:
+                continue
+            messages.append((pos, definition, timestamp))
+            for key, _, count, kind, _, scale, offset, date_time in definition.fields:
+                if count == 1 and kind in (_KIND_INT, _KIND_FLOAT):
+                    name = key if isinstance(key, str) else "field_{}".format(key)
+                    # offset date_time fields to unix timestamps
+                    names[name] = (1, -_FIT_EPOCH) if date_time else (scale, offset)
+
+        if fields is not None:
+            names = {name: names.get(name, (1, 0)) for name in fields}
+        names.pop("timestamp", None)
+
+        length = len(messages)
+        timestamps = array("q", bytes(8 * length))
+        values = {name: array("d", [nan]) * length for name in names}
+
+        # Second pass fills the columns with the raw values
+        view = self._view
+        for row, (pos, definition, timestamp) in enumerate(messages):
+            raw = definition.struct.unpack_from(view, pos + 1)
+            for key, index, count, kind, invalid, _, _, _ in definition.fields:
+                if key == "timestamp":
+                    if timestamp is None and raw[index] != invalid:
+                        timestamp = raw[index]
+                    continue
+                name = key if isinstance(key, str) else "field_{}".format(key)
+                column = values.get(name)
+                if column is None or count != 1:
+                    continue
+                value = raw[index]
+                if kind == _KIND_INT and value != invalid:
+                    column[row] = value
+                elif kind == _KIND_FLOAT:
+                    column[row] = value
+            if timestamp is not None:
+                timestamps[row] = timestamp + _FIT_EPOCH
+
+        # Apply scale and offset to whole columns
+        if np is not None:
+            dtype = [("timestamp", "<i8")] + [(name, "<f8") for name in names]
+            out = np.empty(length, dtype=dtype)
+            out["timestamp"] = np.frombuffer(timestamps, dtype=np.int64)
+            for name, (scale, offset) in names.items():
+                column = np.frombuffer(values[name], dtype=np.float64)
+                if scale != 1 or offset:
+                    column = column / scale - offset
+                out[name] = column
+            return out
+
+        for name, (scale, offset) in names.items():
+            if scale != 1 or offset:
+                values[name] = array("d", (v / scale - offset for v in values[name]))
+        values["timestamp"] = timestamps
+        return values
@@ -1,36 +1,114 @@
 import arrow
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from getpass import getpass
 import io
 import logging
+import tempfile
 
 from garminexport.garminclient import GarminClient
 
+from .ratelimit import scheduler
+
 
 logger = logging.getLogger('garmin')
 logger.setLevel(logging.DEBUG)
 
 
-def get_activities(username, password, last_sync=0):
+def _download(client, activity_id, spool_size=None, cache=None):
+    summary = scheduler.call('garmin', client.get_activity_summary, activity_id)
+    fit = scheduler.call('garmin', client.get_activity_fit, activity_id)
+
+    if fit is None:
+        # manually entered activities have no FIT file, nothing to cache
+        logger.info('Activity {} has no FIT file'.format(activity_id))
+    elif cache is not None:
+        cache.put(
+            activity_id,
+            summary['activityName'],
+            summary['activityTypeDTO']['typeKey'],
+            fit
+        )
+        cached = cache.get(activity_id)
+        if cached is not None:
+            return cached
+
+    if spool_size is None:
+        fit_file = io.BytesIO(fit)
+    else:
+        fit_file = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        if fit is not None:
+            fit_file.write(fit)
+            fit_file.seek(0)
+
+    return tuple((
+        summary['activityName'],
+        summary['activityTypeDTO']['typeKey'],
+        fit_file
+    ))
+
 
-    data = list()
+def iter_activities(username, password, last_sync=0, workers=4,
+                    spool_size=None, cache=None):
+    """Download activities newer than last_sync
 
+    Summaries and FIT files are fetched on a pool of workers threads,
+    with at most twice that many downloads in flight, and
+    (name, type, fit) tuples are yielded as they complete. FIT files
+    larger than spool_size bytes are kept on disk rather than in memory.
+    Activities found in cache (an ActivityCache) are read from it and
+    the ones downloaded are added to it.
+    """
     with GarminClient(username, password) as client:
 
         activities = [list(act) for act in client.list_activities()
                       if act[1].timestamp() > last_sync]
 
-        for act in activities:
-            summary = client.get_activity_summary(act[0])
-            fit_file = io.BytesIO(client.get_activity_fit(act[0]))
-            data.append(
-                tuple((
-                    summary['activityName'],
-                    summary['activityTypeDTO']['typeKey'],
-                    fit_file
-                ))
-            )
-
-    return data
+        if cache is not None:
+            missing = []
+            for act in activities:
+                cached = cache.get(act[0])
+                if cached is None:
+                    missing.append(act)
+                else:
+                    yield cached
+            activities = missing
+
+        logger.info('Downloading {} activities'.format(len(activities)))
+
+        pending = iter(activities)
+        running = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for act in pending:
+                    running.add(executor.submit(
+                        _download, client, act[0], spool_size, cache
+                    ))
+                    if len(running) >= 2 * workers:
+                        break
+
+                if not running:
+                    break
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+
+def _in_memory(activity):
+    name, activity_type, fit_file = activity
+    if isinstance(fit_file, io.BytesIO):
+        return activity
+    with fit_file:
+        return name, activity_type, io.BytesIO(fit_file.read())
+
+
+def get_activities(username, password, last_sync=0, workers=4, cache=None):
+    """List of the activities of iter_activities, read into memory
+
+    Cached FIT files are read and closed rather than kept open."""
+    return [_in_memory(act) for act in iter_activities(
+        username, password, last_sync, workers, cache=cache
+    )]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# (requests per second, burst) shared by all clients of each service
+SERVICE_BUDGETS = {
+    "withings": (2.0, 20),  # 120 requests per minute
+    "strava": (0.1, 100),  # 100 requests per 15 minutes
+    "garmin": (1.0, 10),
+}
+
+DEFAULT_BUDGET = (1.0, 10)
+
+
+class TokenBucket:
+    """Thread safe token bucket
+
+    Tokens are reserved up front, the bucket can go into debt and the
+    caller is told how long to wait for its token."""
+
+    def __init__(self, rate, capacity):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take tokens, return the seconds to wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self._rate
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    def drain(self):
+        """Empty the bucket, e.g. when the service reports a rate limit"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0)
+
+
+class RequestScheduler:
+    """Route service requests through per-service token buckets
+
+    Failed calls are retried when retry_on(error) says so: True retries
+    after a jittered exponential backoff, a number retries after that
+    many seconds. A retried rate limit also drains the bucket so that
+    other callers of the service slow down too."""
+
+    def __init__(self, budgets=None, retries=5, backoff=1.0, max_backoff=60.0):
+        self._budgets = dict(SERVICE_BUDGETS, **(budgets or {}))
+        self._buckets = dict()
+        self._lock = threading.Lock()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def bucket(self, service):
+        with self._lock:
+            bucket = self._buckets.get(service)
+            if bucket is None:
+                rate, capacity = self._budgets.get(service, DEFAULT_BUDGET)
+                bucket = self._buckets[service] = TokenBucket(rate, capacity)
+            return bucket
+
+    def _retry_delay(self, service, attempt, error, retry_on):
+        """Seconds to wait before retrying or None to give up"""
+        if retry_on is None or attempt >= self.retries:
+            return None
+        retry = retry_on(error)
+        if retry is False or retry is None:
+            return None
+
+        self.bucket(service).drain()
+        if retry is not True:
+            return float(retry)
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)  # nosec
+
+    def call(self, service, func, *args, retry_on=None, **kwargs):
+        """Call func(*args, **kwargs) within the budget of service"""
+        bucket = self.bucket(service)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(service, attempt, e, retry_on)
+                if delay is None:
+                    raise
+                logger.warning(
+                    "{} request failed ({!r}), retry in {:.1f} s".format(
+                        service, e, delay
+                    )
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    async def call_async(self, service, func, *args, retry_on=None, **kwargs):
+        """Await func(*args, **kwargs) within the budget of service"""
+        bucket = self.bucket(service)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(service, attempt, e, retry_on)
+                if delay is None:
+                    raise
+                logger.warning(
+                    "{} request failed ({!r}), retry in {:.1f} s".format(
+                        service, e, delay
+                    )
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+
+
+# Scheduler shared by all clients unless they are given their own
+scheduler = RequestScheduler()
@@ -1,43 +1,137 @@
 import logging
+import time
 
 from stravalib.client import Client
+from stravalib.exc import RateLimitExceeded, RateLimitTimeout
+
+from .ratelimit import scheduler as default_scheduler
 
 
 logger = logging.getLogger("strava")
 logger.setLevel(logging.DEBUG)
 
 
+def retry_rate_limit(error):
+    """Retry Strava rate limit errors, after the timeout given by Strava"""
+    if isinstance(error, (RateLimitExceeded, RateLimitTimeout)):
+        return getattr(error, "timeout", None) or True
+    return False
+
+
+class StravaToken:
+    """Strava OAuth token, refreshed only once it is about to expire
+
+    token is the dict kept in the config, it is updated in place."""
+
+    # Refresh tokens expiring within this many seconds
+    MARGIN = 300
+
+    def __init__(self, token, margin=MARGIN):
+        self.token = token
+        self.margin = margin
+
+    @property
+    def expired(self):
+        expires_at = self.token.get("expires_at")
+        if not expires_at or not self.token.get("access_token"):
+            return True
+        return expires_at - self.margin <= time.time()
+
+    def refresh(self, client, call):
+        """Refresh the token with call(client.refresh_access_token, ...)"""
+        response = call(
+            client.refresh_access_token,
+            client_id=self.token["client_id"],
+            client_secret=self.token["client_secret"],
+            refresh_token=self.token["refresh_token"],
+        )
+        self.token.update(response)
+        logger.debug("Refreshed STRAVA token")
+
+    def access_token(self, client, call):
+        """A valid access token, refreshing it if needed"""
+        if self.expired:
+            self.refresh(client, call)
+        return self.token["access_token"]
+
+
 class Strava:
-    def __init__(self, token):
-        self._token = token
-        self._client = None
-        self._verbose = True
+    # Precision of the athlete weight kept by Strava
+    WEIGHT_DIGITS = 1
 
-    def connect(self):
-        self._client = Client()
-        token = self._token
+    def __init__(self, token, scheduler=None, verbose=False):
+        self._token = StravaToken(token)
+        self._client = None
+        self._verbose = verbose
+        self._scheduler = scheduler or default_scheduler
 
-        refresh_response = self._client.refresh_access_token(
-            client_id=token["client_id"],
-            client_secret=token["client_secret"],
-            refresh_token=token["refresh_token"],
+    def _call(self, func, *args, **kwargs):
+        return self._scheduler.call(
+            "strava", func, *args, retry_on=retry_rate_limit, **kwargs
         )
 
-        token.update(refresh_response)
-        self._token = token
+    def connect(self):
+        """Connect, reusing the cached access token while it is valid
+
+        Returns the token dict to save in the config."""
+        self._client = Client()
+        self._client.access_token = self._token.access_token(self._client, self._call)
 
-        athlete = self._client.get_athlete()
         if self._verbose:
+            athlete = self._call(self._client.get_athlete)
             logger.info(
                 'Connected to STRAVA as athelete "{} {}"'.format(
                     athlete.firstname, athlete.lastname
                 )
             )
 
-        return self._token
+        return self._token.token
+
+    def _connected(self):
+        if self._client is None:
+            self.connect()
+        return self._client
 
     def set_weight(self, weight):
-        self._client.update_athlete(weight=weight)
+        """Set the athlete weight, returns False when it is unchanged
+
+        The last weight set is cached with the token so Strava is only
+        called when the rounded value changes."""
+        weight = round(float(weight), self.WEIGHT_DIGITS)
+        if self._token.token.get("weight") == weight:
+            logger.debug("STRAVA weight already {}".format(weight))
+            return False
+
+        self._call(self._connected().update_athlete, weight=weight)
+        self._token.token["weight"] = weight
+        return True
+
+    def activities(self, after=None, before=None):
+        """List of the athlete's activities between after and before"""
+        client = self._connected()
+        return self._call(
+            lambda: list(client.get_activities(after=after, before=before))
+        )
+
+    def upload(self, fit_file, name=None):
+        """Start the upload of a FIT file, returns the uploader to poll
+
+        The file is uploaded from its current position, which is restored
+        before a rate limited upload is retried."""
+        client = self._connected()
+        start = fit_file.tell()
+
+        def upload():
+            fit_file.seek(start)
+            return client.upload_activity(
+                activity_file=fit_file, data_type="fit", name=name
+            )
+
+        return self._call(upload)
+
+    def poll(self, uploader):
+        """Update the status of an upload"""
+        return self._call(uploader.poll)
 
     @property
     def client(self):
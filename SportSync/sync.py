@@ -1,134 +1,302 @@
 import arrow
 import logging
-import yaml
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
 from datetime import datetime
+from threading import BoundedSemaphore
 
 import garth
-import io
-from statistics import mean
-from .withings import WithingsAPI
+from .withings import WithingsAPI, MeasurementStore, RollingStats
+from .withings.withings import HEIGHT_TTL
 from .strava import Strava
+from .ratelimit import scheduler
+from .config import ConfigStore
 
 from .fit import FitEncoderWeight
 
 logger = logging.getLogger(__name__)
 
 
-def write_config(config):
-    with open("config.yml", "w") as outfile:
-        yaml.dump(config, outfile, default_flow_style=False)
-
-
-def get_config():
-    with open("config.yml") as c:
-        config = yaml.load(c, Loader=yaml.Loader)
-
-    return config
+# Default number of accounts talking to each service at once
+SERVICE_LIMITS = {
+    "withings": 4,
+    "garmin": 4,
+    "strava": 4,
+}
 
 
 def update_config(credentials, config):
     config["withings"] = credentials
 
 
-def withings_sync(force=False):
-    config = get_config()
+def service_semaphores(service_limits=None):
+    """Semaphores holding the SERVICE_LIMITS, updated with service_limits"""
+    return {
+        service: BoundedSemaphore(n)
+        for service, n in dict(SERVICE_LIMITS, **(service_limits or {})).items()
+    }
 
-    withings = WithingsAPI(
-        config["withings"], save_callback=update_config, save_callback_args=(config,)
-    )
-    withings.authenticate()
 
-    garth_api = garth.Client(domain="garmin.com")
-    garth_api.loads(config["garth"])
-    # garth_api.loads('~/.garth')
+def _limit(limits, service):
+    """Context holding the concurrency limit of a service if there is one"""
+    if limits is None or service not in limits:
+        return nullcontext()
+    return limits[service]
 
-    # garth_api.login(config['garmin']['username'],
-    #                 config['garmin']['password'])
-    #
-    # config['garth'] = garth_api.dumps()
-    # write_config(config)
 
-    scale_data = withings.get_measures(arrow.utcnow().shift(days=-21))
-    scale_height = withings.get_height(arrow.Arrow.fromtimestamp(0))
+def store_path(config):
+    """Path of the measurement store of the account of a config
 
-    # Now check if we need to update
-    last_update = scale_data[-1].timestamp.int_timestamp
+    The store is nokia.store, relative to the config file, by default
+    the config file name with .measurements.db instead of its extension,
+    so that accounts whose configs share a directory do not share it."""
+    directory, name = os.path.split(config.path)
+    default = os.path.splitext(name)[0] + ".measurements.db"
+    return os.path.join(directory, config["nokia"].get("store", default))
 
-    logger.info("Last measurement at {}".format(last_update))
-    logger.info("Last update at {}".format(config["nokia"]["last_update"]))
 
-    if (config["nokia"]["last_update"] >= last_update) and not force:
-        logger.info("No new weight updates")
-        return
+def withings_sync(force=False, config_file="config.yml", limits=None):
+    # Changed sections are written back once, even if the sync fails
+    with ConfigStore.open(config_file) as config:
+        with AccountSync(config, limits=limits) as account:
+            account.fetch()
+            account.sync(force=force)
 
-    fit = FitEncoderWeight()
-    fit.write_file_info()
-    fit.write_file_creator()
 
-    for measure in scale_data:
+class AccountSync:
+    """Sync of one account
 
-        bmi = measure.weight / scale_height[-1].height ** 2
-
-        logger.info(
-            "New measurement {} ({})".format(
-                measure.timestamp.format(), measure.timestamp.humanize()
-            )
-        )
-        logger.info("New weight = {} kg".format(measure.weight))
-        logger.info("New fat ratio= {} %".format(measure.fat_ratio))
-        logger.info("New hydration = {} %".format(measure.hydration))
-        logger.info("New bone mass = {} kg".format(measure.bone_mass))
-        logger.info("New muscle mass = {} kg".format(measure.muscle_mass))
-        logger.info("Calculated BMI = {} kg.m^-2".format(bmi))
+    Authenticates to Withings and loads the Garmin session on creation and
+    keeps them, with the measurement store, open until closed so that
+    fetch and sync can be repeated without paying for them again."""
 
-        # Sync Garmin
+    def __init__(self, config, limits=None):
+        self.config = config
+        self._limits = limits
 
-        fit.write_device_info(timestamp=measure.timestamp.int_timestamp)
-        fit.write_weight_scale(
-            timestamp=measure.timestamp.int_timestamp,
-            weight=measure.weight,
-            percent_fat=measure.fat_ratio,
-            percent_hydration=measure.hydration,
-            bone_mass=measure.bone_mass,
-            muscle_mass=measure.muscle_mass,
-            bmi=bmi,
+        self.withings = WithingsAPI(
+            config["withings"],
+            save_callback=update_config,
+            save_callback_args=(config,),
         )
-    fit.finish()
-
-    data = io.BytesIO(fit.getvalue())
-    data.name = "withings.fit"
-
-    garth_api.upload(data)
-
-    # Sync Strava
+        with _limit(limits, "withings"):
+            self.withings.authenticate()
+
+        self.garth = garth.Client(domain="garmin.com")
+        self.garth.loads(config["garth"])
+        # garth_api.loads('~/.garth')
+
+        # garth_api.login(config['garmin']['username'],
+        #                 config['garmin']['password'])
+        #
+        # config['garth'] = garth_api.dumps()
+
+        self.store = MeasurementStore(store_path(config))
+        self._strava = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.store.close()
+
+    def fetch(self, start=None, end=None):
+        """Store the groups modified since the last fetch, return the count
+
+        With start and end only the groups measured between them are
+        fetched, e.g. for a notification."""
+        store = self.store
+        if start is not None:
+            with _limit(self._limits, "withings"):
+                count = store.add_pages(
+                    "scale",
+                    self.withings.iter_measure_pages(arrow.get(start), arrow.get(end)),
+                )
+            logger.info(
+                "Fetched {} measurements between {} and {}".format(count, start, end)
+            )
+            return count
 
-    ts = datetime.timestamp(datetime.now())
-    ts -= config["nokia"]["weight_int"] * 86400
+        now = arrow.utcnow()
+        window_start = now.shift(days=-21).int_timestamp
 
-    weight = [m.weight for m in scale_data if m.timestamp.int_timestamp >= ts]
-    logger.info("Averaging {} weight measurements".format(len(weight)))
-    weight = mean(weight)
+        since = store.get_watermark("withings.scale") or window_start
+        with _limit(self._limits, "withings"):
+            count = store.add_pages(
+                "scale", self.withings.iter_measure_pages(arrow.get(since))
+            )
+        store.set_watermark("withings.scale", now.int_timestamp)
+        logger.info("Fetched {} new or modified measurements".format(count))
+        return count
+
+    def sync(self, force=False):
+        """Upload the stored measurements not synced yet"""
+        config = self.config
+        limits = self._limits
+        store = self.store
+        window_start = arrow.utcnow().shift(days=-21).int_timestamp
+
+        # Now check if we need to update
+        last_update = store.get_watermark("garmin", config["nokia"]["last_update"])
+        logger.info("Last update at {}".format(last_update))
+
+        scale_data = store.frame("scale", since=window_start if force else last_update)
+        if not len(scale_data):
+            logger.info("No new weight updates")
+            return
+
+        timestamps = scale_data.timestamps
+        last_measure = int(timestamps[-1])
+        logger.info("Last measurement at {}".format(last_measure))
+
+        with _limit(limits, "withings"):
+            heights = self.withings.get_height_series(
+                store, ttl=config["nokia"].get("height_ttl", HEIGHT_TTL)
+            )
 
-    measure_time = max(
-        [
-            m.timestamp.int_timestamp
-            for m in scale_data
-            if m.timestamp.int_timestamp >= ts
-        ]
-    )
+        fit = FitEncoderWeight(
+            compressed_timestamps=config["nokia"].get("compressed_timestamps", False)
+        )
+        fit.write_file_info()
+        fit.write_file_creator()
+
+        weight = scale_data["weight"]
+        bmis = [heights.bmi(w, int(ts)) for w, ts in zip(weight, timestamps)]
+        for row, bmi in enumerate(bmis):
+            timestamp = scale_data.arrow(row)
+            logger.info(
+                "New measurement {} ({})".format(
+                    timestamp.format(), timestamp.humanize()
+                )
+            )
+            logger.info("New weight = {} kg".format(weight[row]))
+            logger.info("New fat ratio= {} %".format(scale_data["fat_ratio"][row]))
+            logger.info("New hydration = {} %".format(scale_data["hydration"][row]))
+            logger.info("New bone mass = {} kg".format(scale_data["bone_mass"][row]))
+            logger.info(
+                "New muscle mass = {} kg".format(scale_data["muscle_mass"][row])
+            )
+            logger.info("Calculated BMI = {} kg.m^-2".format(bmi))
 
-    if (config["nokia"]["last_update"] <= measure_time) or force:
-        logger.info("Syncing weight of {} with STRAVA.".format(measure.weight))
-        strava = Strava(config["strava"])
-        strava_token = strava.connect()
-        config["strava"] = strava_token
-        strava.client.update_athlete(weight=weight)
+        # Sync Garmin
 
-        logger.info("Synced weight of {} with Strava".format(measure.weight))
+        # Measures missing from a group are NaN and written as invalid values
+        fit.write_weight_scale_batch(
+            timestamps=timestamps,
+            weight=weight,
+            percent_fat=scale_data["fat_ratio"],
+            percent_hydration=scale_data["hydration"],
+            bone_mass=scale_data["bone_mass"],
+            muscle_mass=scale_data["muscle_mass"],
+            bmi=bmis,
+        )
+        fit.finish()
+
+        # Upload the encoder buffer as is rather than a copy of it
+        data = fit.buf
+        data.seek(0)
+        data.name = "withings.fit"
+
+        with _limit(limits, "garmin"):
+            scheduler.call("garmin", self.garth.upload, data)
+        store.set_watermark("garmin", max(last_update, last_measure))
+
+        self._sync_strava(force)
+
+        config["nokia"]["last_update"] = store.get_watermark("garmin")
+        config.mark_dirty("nokia")
+
+    def _sync_strava(self, force=False):
+        config = self.config
+        store = self.store
+
+        # Only the groups measured since the saved statistics are read
+        window = config["nokia"]["weight_int"] * 86400
+        now = int(datetime.timestamp(datetime.now()))
+        weights = RollingStats.load(store, "strava.weight", window)
+        recent = store.frame("scale", since=max(weights.last or 0, now - window))
+        for epoch, value in zip(recent.timestamps, recent["weight"]):
+            weights.add(int(epoch), float(value))
+        weights.expire(now)
+        weights.save(store, "strava.weight")
+
+        statistic = config["nokia"].get("weight_average", "mean")
+        weight = weights.value(statistic)
+        logger.info(
+            "Weight {} of {} measurements is {}".format(statistic, len(weights), weight)
+        )
 
-    config = get_config()
-    config["nokia"]["last_update"] = max(
-        [m.timestamp.int_timestamp for m in scale_data]
-    )
+        measure_time = weights.last
+        strava_update = store.get_watermark("strava", config["nokia"]["last_update"])
+
+        if not len(weights):
+            logger.info("No weight measurements to sync with STRAVA")
+        elif (strava_update < measure_time) or force:
+            logger.info("Syncing weight of {} with STRAVA.".format(weight))
+            with _limit(self._limits, "strava"):
+                # Connects lazily, only when the rounded weight changed
+                if self._strava is None:
+                    self._strava = Strava(config["strava"])
+                updated = self._strava.set_weight(weight)
+            # The token and cached weight are updated in place
+            config.mark_dirty("strava")
+            store.set_watermark("strava", measure_time)
+
+            if updated:
+                logger.info("Synced weight of {} with Strava".format(weight))
+
+    def latest_measure(self):
+        """Time of the most recent stored scale measurement, or None"""
+        group = self.store.latest("scale")
+        return None if group is None else group.epoch
+
+
+@dataclass
+class SyncResult:
+    """Outcome of syncing one account"""
+
+    config_file: str
+    elapsed: float
+    error: Exception = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def sync_accounts(config_files, workers=8, service_limits=None, force=False):
+    """Sync several accounts concurrently
+
+    Each config file is one account, synced on a pool of workers threads.
+    service_limits caps how many accounts talk to each service at once
+    (see SERVICE_LIMITS) to stay clear of the rate limits."""
+    limits = service_semaphores(service_limits)
+
+    def run(config_file):
+        start = time.monotonic()
+        try:
+            withings_sync(force=force, config_file=config_file, limits=limits)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("Sync of {} failed".format(config_file))
+            return SyncResult(config_file, time.monotonic() - start, e)
+        return SyncResult(config_file, time.monotonic() - start)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, config_files))
+
+    for result in results:
+        logger.info(
+            "{} {} in {:.1f} s".format(
+                result.config_file,
+                "synced" if result.ok else "failed ({})".format(result.error),
+                result.elapsed,
+            )
+        )
 
-    write_config(config)
+    return results
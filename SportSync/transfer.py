@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import logging
+import time
+
+from .fit import FitDecodeError, FitDecoder
+from .garmin import iter_activities
+
+logger = logging.getLogger(__name__)
+
+# Activities starting and lasting within this many seconds are the same
+DUPLICATE_TOLERANCE = 60
+
+# Seconds to wait for Strava to process the uploads
+UPLOAD_TIMEOUT = 600
+
+
+def fit_session_times(fit_file):
+    """(start, elapsed seconds) of the first session in a FIT file
+
+    Either is None when not found. The file is rewound afterwards."""
+    try:
+        with FitDecoder(fit_file, check_crc=False) as decoder:
+            sessions = decoder.columns(
+                "session", fields=["start_time", "total_elapsed_time"]
+            )
+            if not len(sessions["start_time"]):
+                return None, None
+            start = sessions["start_time"][0]
+            elapsed = sessions["total_elapsed_time"][0]
+    except FitDecodeError as e:
+        logger.warning("Could not read FIT file: {}".format(e))
+        return None, None
+    finally:
+        fit_file.seek(0)
+
+    # NaN marks a missing value
+    return (
+        None if start != start else start,
+        None if elapsed != elapsed else elapsed,
+    )
+
+
+def _seconds(value):
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    return float(value)
+
+
+def strava_activity_times(strava, after):
+    """Sorted (start, elapsed seconds) of Strava activities since after"""
+    return sorted(
+        (act.start_date.timestamp(), _seconds(act.elapsed_time))
+        for act in strava.activities(after=after)
+    )
+
+
+def is_duplicate(existing, start, elapsed, tolerance=DUPLICATE_TOLERANCE):
+    """Is there an activity in the sorted existing times like this one"""
+    index = bisect_left(existing, (start - tolerance,))
+    while index < len(existing) and existing[index][0] <= start + tolerance:
+        if elapsed is None or abs(existing[index][1] - elapsed) <= tolerance:
+            return True
+        index += 1
+    return False
+
+
+def _upload(strava, fit_file, name):
+    try:
+        return strava.upload(fit_file, name)
+    finally:
+        fit_file.close()
+
+
+def poll_uploads(strava, uploads, interval=2.0, timeout=UPLOAD_TIMEOUT):
+    """Wait for uploads to finish, polling all pending ones each round
+
+    uploads is a list of (name, uploader), returns a list of (name,
+    Strava activity id or the error). Uploads still processing after
+    timeout seconds are returned with a TimeoutError."""
+    results = []
+    pending = list(uploads)
+    deadline = time.monotonic() + timeout
+    while pending:
+        if time.monotonic() >= deadline:
+            logger.warning("{} uploads still processing".format(len(pending)))
+            error = TimeoutError("Still processing after {} s".format(timeout))
+            results.extend((name, error) for name, _ in pending)
+            break
+        time.sleep(interval)
+        still_pending = []
+        for name, uploader in pending:
+            try:
+                strava.poll(uploader)
+            except Exception as e:  # pylint: disable=broad-except
+                results.append((name, e))
+                continue
+            if uploader.is_complete:
+                results.append((name, uploader.activity_id))
+            elif uploader.is_error:
+                results.append((name, uploader.error))
+            else:
+                still_pending.append((name, uploader))
+        pending = still_pending
+        logger.debug("{} uploads still processing".format(len(pending)))
+
+    return results
+
+
+def garmin_to_strava(
+    username,
+    password,
+    strava,
+    last_sync=0,
+    workers=4,
+    cache=None,
+    poll_interval=2.0,
+    poll_timeout=UPLOAD_TIMEOUT,
+):
+    """Upload Garmin activities since last_sync to Strava
+
+    Activities already on Strava (same start and elapsed time within
+    DUPLICATE_TOLERANCE) are skipped. The others are uploaded on a pool
+    of workers threads as they are downloaded and the uploads are then
+    polled together, for up to poll_timeout seconds. Returns a list of
+    (activity name, result) where result is the new Strava activity id,
+    the upload error or None for skipped duplicates."""
+    after = datetime.fromtimestamp(last_sync, tz=timezone.utc) - timedelta(days=1)
+    existing = strava_activity_times(strava, after)
+    logger.info("Found {} activities on Strava".format(len(existing)))
+
+    results = []
+    uploads = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, activity_type, fit_file in iter_activities(
+            username, password, last_sync, workers=workers, cache=cache
+        ):
+            start, elapsed = fit_session_times(fit_file)
+            if start is not None and is_duplicate(existing, start, elapsed):
+                logger.info("Skipping {}, already on Strava".format(name))
+                results.append((name, None))
+                fit_file.close()
+                continue
+
+            logger.info("Uploading {} ({})".format(name, activity_type))
+            uploads.append((name, executor.submit(_upload, strava, fit_file, name)))
+
+    started = []
+    for name, future in uploads:
+        try:
+            started.append((name, future.result()))
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error("Upload of {} failed: {}".format(name, e))
+            results.append((name, e))
+
+    return results + poll_uploads(strava, started, poll_interval, poll_timeout)
@@ -0,0 +1,213 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Event, Lock
+from urllib.parse import urlsplit
+
+from .config import ConfigStore
+from .sync import AccountSync, service_semaphores
+from .withings.notify import NotificationServer
+from .withings.withings import AuthFailedException
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval:
+    """Polling interval which backs off while nothing happens
+
+    After a change, or while the last measurement is less than recent
+    seconds old, the interval is minimum. Every idle poll multiplies it by
+    factor, up to maximum."""
+
+    def __init__(self, minimum=60, maximum=900, factor=2.0, recent=3600):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.recent = recent
+        self.interval = minimum
+
+    def update(self, changed, last_measure=None, now=None):
+        """Interval until the next poll"""
+        if now is None:
+            now = time.time()
+        if changed or (last_measure is not None and now - last_measure < self.recent):
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.interval * self.factor, self.maximum)
+        return self.interval
+
+
+class AccountWatcher:
+    """Polls one account, keeping its AccountSync open between polls
+
+    The account is synced on the first poll and then whenever the fetch
+    finds new or modified measurements. Notified date windows are fetched
+    on the next poll instead of the regular fetch. After an error the
+    sessions are dropped and created again on the next poll. With a
+    callback_url the account is subscribed to notifications."""
+
+    def __init__(self, config_file, limits=None, interval=None, callback_url=None):
+        self.config_file = config_file
+        self.interval = interval or AdaptiveInterval()
+        self.next_poll = 0.0
+        self._limits = limits
+        self._callback_url = callback_url
+        self._account = None
+        self._lock = Lock()
+        self._windows = []
+
+    @property
+    def userid(self):
+        return ConfigStore.open(self.config_file)["withings"].userid
+
+    def close(self):
+        if self._account is not None:
+            try:
+                self._account.close()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Closing {} failed".format(self.config_file))
+            finally:
+                self._account = None
+
+    def notify(self, notification):
+        """Fetch the window of a notification on the next poll, now"""
+        with self._lock:
+            self._windows.append((notification.startdate, notification.enddate))
+            self.next_poll = 0.0
+
+    def _subscribe(self, withings):
+        urls = [p.get("callbackurl") for p in withings.list_subscriptions()]
+        if self._callback_url not in urls:
+            withings.subscribe(self._callback_url)
+            logger.info("Subscribed {} to notifications".format(self.config_file))
+
+    def _fetch(self, account, windows):
+        if not windows:
+            return account.fetch()
+        return sum(account.fetch(start, end) for start, end in windows)
+
+    def poll(self):
+        config = ConfigStore.open(self.config_file)
+        with self._lock:
+            windows, self._windows = self._windows, []
+        first = self._account is None
+        try:
+            if first:
+                self._account = AccountSync(config, limits=self._limits)
+                if self._callback_url:
+                    self._subscribe(self._account.withings)
+            try:
+                changed = self._fetch(self._account, windows) > 0
+            except AuthFailedException:
+                # the token was revoked or expired early
+                self._account.withings.refresh_token()
+                changed = self._fetch(self._account, windows) > 0
+            if changed or first:
+                self._account.sync()
+            last_measure = self._account.latest_measure()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Poll of {} failed".format(self.config_file))
+            self.close()
+            changed, last_measure = False, None
+            with self._lock:
+                self._windows[:0] = windows
+        finally:
+            config.save()
+
+        interval = self.interval.update(changed, last_measure)
+        with self._lock:
+            # poll again right away for notifications received meanwhile
+            self.next_poll = 0.0 if self._windows else time.monotonic() + interval
+        logger.debug("Next poll of {} in {:.0f} s".format(self.config_file, interval))
+
+
+def watch(
+    config_files,
+    workers=8,
+    service_limits=None,
+    minimum=60,
+    maximum=900,
+    recent=3600,
+    stop=None,
+    listen=None,
+    callback_url=None,
+):
+    """Poll accounts until stop is set
+
+    Each config file is one account, polled with its own adaptive interval
+    (see AdaptiveInterval) on a pool of workers threads, a slow account
+    does not hold up the polls of the others. With listen, a
+    (host, port) address, Withings notifications are received there and
+    trigger a poll of the notified account and dates right away. The
+    accounts are subscribed to callback_url, the public URL of the
+    receiver."""
+    limits = service_semaphores(service_limits)
+    if stop is None:
+        stop = Event()
+    wake = Event()
+
+    watchers = [
+        AccountWatcher(
+            config_file,
+            limits=limits,
+            interval=AdaptiveInterval(minimum, maximum, recent=recent),
+            callback_url=callback_url,
+        )
+        for config_file in config_files
+    ]
+
+    server = None
+    if listen is not None:
+        users = {watcher.userid: watcher for watcher in watchers}
+
+        def received(notification):
+            watcher = users.get(notification.userid)
+            if watcher is None:
+                logger.warning(
+                    "Notification for unknown user {}".format(notification.userid)
+                )
+                return
+            watcher.notify(notification)
+            wake.set()
+
+        path = urlsplit(callback_url).path if callback_url else ""
+        server = NotificationServer(listen, received, path=path or "/")
+        server.start()
+
+    def done(watcher, future):
+        if future.exception() is not None:
+            logger.error(
+                "Poll of {} failed".format(watcher.config_file),
+                exc_info=future.exception(),
+            )
+            watcher.next_poll = time.monotonic() + watcher.interval.interval
+        wake.set()
+
+    logger.info("Watching {} accounts".format(len(watchers)))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # the accounts being polled, each poll runs on its own
+            polling = {}
+            while not stop.is_set():
+                for watcher, future in list(polling.items()):
+                    if future.done():
+                        del polling[watcher]
+
+                now = time.monotonic()
+                for watcher in watchers:
+                    if watcher not in polling and watcher.next_poll <= now:
+                        future = polling[watcher] = executor.submit(watcher.poll)
+                        future.add_done_callback(partial(done, watcher))
+
+                # wake up for finished polls, notifications and to check
+                # stop every second
+                idle = [w.next_poll for w in watchers if w not in polling]
+                wait = min(idle, default=now + 1.0) - time.monotonic()
+                wake.wait(min(max(wait, 0), 1.0))
+                wake.clear()
+    finally:
+        if server is not None:
+            server.stop()
+        for watcher in watchers:
+            watcher.close()
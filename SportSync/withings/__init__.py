@@ -1,2 +1,14 @@
 from .withings import WithingsAPI, WithingsCredentials
-__all__ = (WithingsAPI, WithingsCredentials)
+from .store import MeasurementStore
+from .frame import WithingsMeasureFrame
+from .rolling import RollingStats
+from .notify import NotificationServer, WithingsNotification
+__all__ = (
+    WithingsAPI,
+    WithingsCredentials,
+    MeasurementStore,
+    WithingsMeasureFrame,
+    RollingStats,
+    NotificationServer,
+    WithingsNotification,
+)
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from ..ratelimit import scheduler as default_scheduler
+from .withings import (
+    HEIGHT_MEASTYPES,
+    SCALE_MEASTYPES,
+    STATUS_EXCEPTIONS,
+    STATUS_SUCCESS,
+    AuthFailedException,
+    HTTPStatusException,
+    UnknownStatusException,
+    WithingsAPI,
+    WithingsCredentials,
+    WithingsMeasureHeightGroup,
+    WithingsMeasureScaleGroup,
+    WithingsMeasureSeries,
+    retry_status,
+    status_exception,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(limit=100, limit_per_host=0):
+    """Pooled keep-alive HTTP session which can be shared between clients"""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host)
+    )
+
+
+class AsyncWithingsAPI:
+    """asyncio version of WithingsAPI
+
+    Requests go through an aiohttp session, pass one from create_session
+    to share its connection pool between many clients. Token refreshes
+    are single-flight: concurrent calls wait for one refresh."""
+
+    BASE_URL = WithingsAPI.BASE_URL
+
+    def __init__(
+        self,
+        credentials,
+        save_callback=None,
+        save_callback_args=None,
+        session=None,
+        scheduler=None,
+    ):
+        self._session = session
+        self._scheduler = scheduler or default_scheduler
+        self._own_session = session is None
+        self._credentials = credentials
+        self._save_callback = save_callback
+        self._save_callback_args = save_callback_args
+        self._token = {
+            "access_token": self._credentials.access_token,
+            "refresh_token": self._credentials.refresh_token,
+            "token_type": self._credentials.token_type,
+            "expires_in": self._credentials.expires_in,
+        }
+        self._refresh_lock = None
+
+    async def __aenter__(self):
+        await self.authenticate()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def authenticate(self):
+        """Authenticate to withings API"""
+        if self._session is None:
+            self._session = create_session()
+        self._refresh_lock = asyncio.Lock()
+        await self.refresh_token()
+
+    async def refresh_token(self):
+        """Manually refresh the oauth token
+
+        Callers arriving while a refresh is running wait for it and reuse
+        its token instead of refreshing again."""
+        access_token = self._token["access_token"]
+        async with self._refresh_lock:
+            if self._token["access_token"] != access_token:
+                return
+
+            data = {
+                "action": "requesttoken",
+                "grant_type": "refresh_token",
+                "client_id": self._credentials.client_id,
+                "client_secret": self._credentials.client_secret,
+                "refresh_token": self._token["refresh_token"],
+            }
+            async with self._session.post(self.BASE_URL + "/v2/oauth2", data=data) as r:
+                if r.status != 200:
+                    raise HTTPStatusException(status=r.status)
+                response = await r.json(content_type=None)
+
+            status = response.get("status")
+            if status not in STATUS_SUCCESS:
+                raise status_exception(status)
+            self._token_updater(response["body"])
+
+    def _token_updater(self, token):
+        """Update and set the oauth token"""
+        self._token.update(
+            access_token=token["access_token"],
+            refresh_token=token["refresh_token"],
+            expires_in=token["expires_in"],
+        )
+        self._credentials = WithingsCredentials(
+            access_token=token["access_token"],
+            expires_in=token["expires_in"],
+            token_type=self._credentials.token_type,
+            refresh_token=token["refresh_token"],
+            userid=self._credentials.userid,
+            client_id=self._credentials.client_id,
+            client_secret=self._credentials.client_secret,
+            redirect_uri=self._credentials.redirect_uri,
+        )
+        if self._save_callback is not None:
+            self._save_callback(self._credentials, *self._save_callback_args)
+
+    async def _post(self, url, data):
+        headers = {"Authorization": "Bearer " + self._token["access_token"]}
+        async with self._session.post(url, data=data, headers=headers) as r:
+            if r.status != 200:
+                raise HTTPStatusException(status=r.status)
+            return await r.json(content_type=None)
+
+    async def _get_data(self, url, data):
+        """Get data and check response, retrying when rate limited"""
+        return await self._scheduler.call_async(
+            "withings", self._request, url, data, retry_on=retry_status
+        )
+
+    async def _request(self, url, data):
+        """Request and check response, refreshing an expired token once"""
+        access_token = self._token["access_token"]
+        response = await self._post(url, data)
+        status = response.get("status")
+
+        if STATUS_EXCEPTIONS.get(status) is AuthFailedException:
+            logger.debug("Token rejected, refreshing")
+            if self._token["access_token"] == access_token:
+                await self.refresh_token()
+            response = await self._post(url, data)
+            status = response.get("status")
+
+        if status is None:
+            raise UnknownStatusException(status=status)
+
+        if status in STATUS_SUCCESS:
+            return response.get("body")
+
+        raise status_exception(status)
+
+    async def iter_measure_pages(self, start, end=None, meastypes=SCALE_MEASTYPES):
+        """Async generator of the raw getmeas response bodies
+
+        See WithingsAPI.iter_measure_pages."""
+        url = self.BASE_URL + "/v2/measure"
+        data = {
+            "action": "getmeas",
+            "meastypes": meastypes,
+            "category": "1",
+        }
+        if end is None:
+            data["lastupdate"] = start.int_timestamp
+        else:
+            data["startdate"] = start.int_timestamp
+            data["enddate"] = end.int_timestamp
+
+        while True:
+            page = await self._get_data(url, data=data)
+            yield page
+            if not (page.get("more") and page.get("offset")):
+                break
+            data = dict(data, offset=page["offset"])
+
+    async def get_measures(self, lastupdate):
+        val = WithingsMeasureSeries()
+        async for page in self.iter_measure_pages(lastupdate):
+            for group in page.get("measuregrps", []):
+                val.add(WithingsMeasureScaleGroup(group, page.get("timezone")))
+
+        return val
+
+    async def get_height(self, lastupdate):
+        val = WithingsMeasureSeries()
+        async for page in self.iter_measure_pages(
+            lastupdate, meastypes=HEIGHT_MEASTYPES
+        ):
+            for group in page.get("measuregrps", []):
+                val.add(WithingsMeasureHeightGroup(group, page.get("timezone")))
+
+        return val
@@ -0,0 +1,113 @@
+from array import array
+from math import nan
+
+import arrow
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from .withings import WithingsMeasureHeightGroup, WithingsMeasureScaleGroup
+
+# meastype -> column, as in the attributes of the measure group classes
+SCALE_COLUMNS = WithingsMeasureScaleGroup.MEASURES
+HEIGHT_COLUMNS = WithingsMeasureHeightGroup.MEASURES
+
+
+class WithingsMeasureFrame:
+    """Withings measure groups as columns
+
+    timestamps holds the epoch seconds of each group and there is one float
+    column per measure type with NaN where a group does not have it. The
+    columns are NumPy arrays when NumPy is available, otherwise
+    array.array. The measure group objects are only built when groups is
+    used."""
+
+    def __init__(
+        self, timestamps, columns, source=(), group_class=WithingsMeasureScaleGroup
+    ):
+        self.timestamps = timestamps
+        self.columns = columns
+        self._source = source
+        self._group_class = group_class
+        self._groups = None
+
+    @classmethod
+    def from_groups(
+        cls, groups, columns=SCALE_COLUMNS, group_class=WithingsMeasureScaleGroup
+    ):
+        """Parse (measure group, timezone) pairs as returned by getmeas"""
+        groups = list(groups)
+        names = list(dict.fromkeys(columns.values()))
+        dispatch = {meastype: names.index(name) for meastype, name in columns.items()}
+        width = len(names)
+
+        # Collect the cells of the rows x names table first, the values
+        # are then scaled by their unit all at once
+        timestamps = []
+        cells = []
+        values = []
+        units = []
+        for row, (group, _) in enumerate(groups):
+            timestamps.append(group["date"])
+            base = row * width
+            for measure in group["measures"]:
+                column = dispatch.get(measure["type"])
+                if column is not None:
+                    cells.append(base + column)
+                    values.append(measure["value"])
+                    units.append(measure["unit"])
+
+        if np is not None:
+            table = np.full(len(groups) * width, nan)
+            table[np.asarray(cells, dtype=np.intp)] = np.asarray(
+                values, dtype=np.float64
+            ) * np.power(10.0, np.asarray(units, dtype=np.float64))
+            table = table.reshape(len(groups), width)
+            timestamps = np.asarray(timestamps, dtype=np.int64)
+            data = {name: table[:, n] for n, name in enumerate(names)}
+        else:
+            table = array("d", [nan]) * (len(groups) * width)
+            for cell, value, unit in zip(cells, values, units):
+                table[cell] = value * pow(10, unit)
+            timestamps = array("q", timestamps)
+            data = {name: table[n::width] for n, name in enumerate(names)}
+
+        return cls(timestamps, data, groups, group_class)
+
+    @classmethod
+    def from_pages(
+        cls, pages, columns=SCALE_COLUMNS, group_class=WithingsMeasureScaleGroup
+    ):
+        """Parse getmeas response bodies"""
+        return cls.from_groups(
+            (
+                (group, page.get("timezone"))
+                for page in pages
+                for group in page.get("measuregrps", [])
+            ),
+            columns,
+            group_class,
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def arrow(self, row):
+        """Timestamp of a row as an Arrow in the timezone of its group"""
+        return arrow.Arrow.fromtimestamp(
+            int(self.timestamps[row]), tzinfo=self._source[row][1]
+        )
+
+    @property
+    def groups(self):
+        """The measure group objects, built on first use"""
+        if self._groups is None:
+            self._groups = [
+                self._group_class(group, timezone) for group, timezone in self._source
+            ]
+        return self._groups
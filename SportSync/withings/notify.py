@@ -0,0 +1,98 @@
+import logging
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class WithingsNotification:
+    """Withings notification of measures of a user between two dates"""
+
+    userid: int
+    appli: int
+    startdate: int
+    enddate: int
+
+    @classmethod
+    def from_form(cls, form):
+        """Parse the parse_qs form posted by Withings"""
+        return cls(
+            userid=int(form["userid"][0]),
+            appli=int(form["appli"][0]),
+            startdate=int(form["startdate"][0]),
+            enddate=int(form["enddate"][0]),
+        )
+
+
+class _NotificationHandler(BaseHTTPRequestHandler):
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        # Withings checks the callback URL answers when subscribing
+        self._reply(200)
+
+    def do_GET(self):
+        self._reply(200)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != self.server.callback_path:
+            self._reply(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(url.query)
+        form.update(parse_qs(self.rfile.read(length).decode("utf-8")))
+        try:
+            notification = WithingsNotification.from_form(form)
+        except (KeyError, ValueError):
+            logger.warning("Invalid notification {}".format(form))
+            self._reply(400)
+            return
+
+        # Withings expects a quick answer, reply before handling it
+        self._reply(200)
+        logger.info("Received {}".format(notification))
+        try:
+            self.server.callback(notification)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Handling {} failed".format(notification))
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class NotificationServer(ThreadingHTTPServer):
+    """HTTP server receiving Withings notifications
+
+    Notifications posted to path are parsed and passed to callback as
+    WithingsNotification, on the thread of the request. The callback
+    should only queue the work, e.g. a targeted getmeas of the notified
+    dates. Use port 0 to listen on a free port, see server_address."""
+
+    daemon_threads = True
+
+    def __init__(self, address, callback, path="/"):
+        super().__init__(address, _NotificationHandler)
+        self.callback = callback
+        self.callback_path = path
+        self._thread = None
+
+    def start(self):
+        """Serve on a background thread"""
+        self._thread = Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Listening for notifications on {}:{}".format(*self.server_address))
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
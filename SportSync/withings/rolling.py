@@ -0,0 +1,129 @@
+from bisect import bisect_left, insort
+from collections import deque
+
+
+class RollingStats:
+    """Statistics of the values measured in a sliding time window
+
+    Values are added in time order with add() and dropped from the window
+    with expire(). A running sum and a sorted copy of the values in the
+    window are kept up to date, so the mean, median, min and max are O(1)
+    and adding or dropping a value is a bisect plus a list insert. ewma is
+    an exponentially weighted moving average of all the values added,
+    whose weights halve every halflife seconds, it is not limited to the
+    window. The trimmed mean leaves out the trim fraction
+    of the lowest and of the highest values, ignoring outliers."""
+
+    STATISTICS = ("mean", "median", "trimmed_mean", "ewma", "min", "max")
+
+    def __init__(self, window, halflife=None, trim=0.1):
+        self.window = window
+        self.halflife = halflife or window / 2
+        self.trim = trim
+        self.ewma = None
+        # time of the last value added
+        self.last = None
+        self._values = deque()
+        self._sorted = []
+        self._sum = 0.0
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, epoch, value):
+        """Add a value, returns False if it is NaN or not after the last"""
+        if value != value or (self.last is not None and epoch <= self.last):
+            return False
+
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            alpha = 1 - 0.5 ** ((epoch - self.last) / self.halflife)
+            self.ewma += alpha * (value - self.ewma)
+        self.last = epoch
+
+        self._values.append((epoch, value))
+        insort(self._sorted, value)
+        self._sum += value
+        return True
+
+    def expire(self, now):
+        """Drop the values measured window seconds or more before now"""
+        start = now - self.window
+        while self._values and self._values[0][0] <= start:
+            _, value = self._values.popleft()
+            del self._sorted[bisect_left(self._sorted, value)]
+            self._sum -= value
+        if not self._values:
+            # do not carry rounding errors over
+            self._sum = 0.0
+
+    @property
+    def mean(self):
+        return self._sum / len(self._values) if self._values else None
+
+    @property
+    def median(self):
+        n = len(self._sorted)
+        if not n:
+            return None
+        if n % 2:
+            return self._sorted[n // 2]
+        return (self._sorted[n // 2 - 1] + self._sorted[n // 2]) / 2
+
+    @property
+    def trimmed_mean(self):
+        n = len(self._sorted)
+        if not n:
+            return None
+        k = int(n * self.trim)
+        kept = self._sorted[k : n - k]
+        return sum(kept) / len(kept)
+
+    @property
+    def min(self):
+        return self._sorted[0] if self._sorted else None
+
+    @property
+    def max(self):
+        return self._sorted[-1] if self._sorted else None
+
+    def value(self, statistic="mean"):
+        """One of STATISTICS by name"""
+        if statistic not in self.STATISTICS:
+            raise ValueError("Unknown statistic {}".format(statistic))
+        return getattr(self, statistic)
+
+    def to_dict(self):
+        return {
+            "window": self.window,
+            "halflife": self.halflife,
+            "trim": self.trim,
+            "ewma": self.ewma,
+            "last": self.last,
+            "values": list(self._values),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data["window"], data["halflife"], data["trim"])
+        stats.ewma = data["ewma"]
+        stats.last = data["last"]
+        for epoch, value in data["values"]:
+            stats._values.append((epoch, value))
+            stats._sum += value
+        stats._sorted = sorted(value for _, value in stats._values)
+        return stats
+
+    @classmethod
+    def load(cls, store, name, window, **kwargs):
+        """State saved in a MeasurementStore, or a new one
+
+        The saved state is dropped when its window is not window."""
+        data = store.get_state(name)
+        if data is None or data["window"] != window:
+            return cls(window, **kwargs)
+        return cls.from_dict(data)
+
+    def save(self, store, name):
+        store.set_state(name, self.to_dict())
@@ -0,0 +1,160 @@
+import json
+import logging
+import sqlite3
+import threading
+
+from .frame import HEIGHT_COLUMNS, SCALE_COLUMNS, WithingsMeasureFrame
+from .withings import (
+    WithingsMeasureHeightGroup,
+    WithingsMeasureScaleGroup,
+    WithingsMeasureSeries,
+)
+
+logger = logging.getLogger(__name__)
+
+GROUP_CLASSES = {
+    "scale": WithingsMeasureScaleGroup,
+    "height": WithingsMeasureHeightGroup,
+}
+FRAME_COLUMNS = {
+    "scale": SCALE_COLUMNS,
+    "height": HEIGHT_COLUMNS,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    kind TEXT NOT NULL,
+    grpid INTEGER NOT NULL,
+    date INTEGER NOT NULL,
+    timezone TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, grpid)
+);
+CREATE INDEX IF NOT EXISTS groups_date ON groups (kind, date);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class MeasurementStore:
+    """Local SQLite cache of Withings measure groups
+
+    Groups are stored as returned by getmeas, keyed by their group id,
+    so fetching a group again replaces it. Watermarks record how far each
+    source has been fetched and each destination has been updated, state
+    holds JSON documents such as running statistics. The store may be
+    used from several threads."""
+
+    def __init__(self, path="measurements.db"):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add_pages(self, kind, pages):
+        """Store the groups of getmeas response bodies, return the count"""
+        # pages may be fetched lazily, do not hold the lock meanwhile
+        rows = [
+            (
+                kind,
+                group["grpid"],
+                group["date"],
+                page.get("timezone"),
+                json.dumps(group),
+            )
+            for page in pages
+            for group in page.get("measuregrps", [])
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+        logger.debug("Stored {} {} groups in {}".format(len(rows), kind, self._path))
+        return len(rows)
+
+    def _rows(self, kind, since=None, until=None):
+        query = "SELECT data, timezone FROM groups WHERE kind = ?"
+        args = [kind]
+        if since is not None:
+            query += " AND date > ?"
+            args.append(since)
+        if until is not None:
+            query += " AND date <= ?"
+            args.append(until)
+        query += " ORDER BY date"
+        with self._lock:
+            return self._conn.execute(query, args).fetchall()
+
+    def groups(self, kind, since=None, until=None):
+        """Stored groups measured after since and up to until, oldest first"""
+        group_class = GROUP_CLASSES[kind]
+        return WithingsMeasureSeries(
+            group_class(json.loads(data), timezone)
+            for data, timezone in self._rows(kind, since, until)
+        )
+
+    def frame(self, kind, since=None, until=None):
+        """Stored groups as a WithingsMeasureFrame (see groups)"""
+        return WithingsMeasureFrame.from_groups(
+            (
+                (json.loads(data), timezone)
+                for data, timezone in self._rows(kind, since, until)
+            ),
+            FRAME_COLUMNS[kind],
+            GROUP_CLASSES[kind],
+        )
+
+    def latest(self, kind):
+        """Most recent stored group or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, timezone FROM groups WHERE kind = ? "
+                "ORDER BY date DESC LIMIT 1",
+                (kind,),
+            ).fetchone()
+        if row is None:
+            return None
+        return GROUP_CLASSES[kind](json.loads(row[0]), row[1])
+
+    def get_watermark(self, name, default=0):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM watermarks WHERE name = ?", (name,)
+            ).fetchone()
+        return default if row is None else row[0]
+
+    def set_watermark(self, name, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (name, value)
+            )
+
+    def get_state(self, name, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM state WHERE name = ?", (name,)
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_state(self, name, data):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state VALUES (?, ?)", (name, json.dumps(data))
+            )
@@ -1,10 +1,14 @@
 import arrow
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from oauthlib.common import to_unicode
 from requests_oauthlib import OAuth2Session
 from oauthlib.oauth2 import WebApplicationClient
 from urllib import parse
 
+from ..ratelimit import scheduler as default_scheduler
+
 import json
 
 # import logging
@@ -263,6 +267,15 @@ STATUS_TIMEOUT = (522,)
 STATUS_BAD_STATE = (524,)
 STATUS_TOO_MANY_REQUESTS = (601,)
 
+SCALE_MEASTYPES = "1,5,6,8,76,77,88"
+HEIGHT_MEASTYPES = "4"
+
+# Seconds between refreshes of the cached height series
+HEIGHT_TTL = 86400
+
+# Notification category of weight and body composition measures
+NOTIFY_APPLI_WEIGHT = 1
+
 
 def adjust_withings_token(response):
     """Restructures token from withings response"""
@@ -291,12 +304,73 @@ class StatusException(Exception):
     def __init__(self, status):
         """Create instance."""
         super().__init__("Error code %s" % str(status))
+        self.status = status
 
 
 class UnknownStatusException(StatusException):
     """Unknown status code but it's still not successful."""
 
 
+class AuthFailedException(StatusException):
+    """Authentication failed, the token needs refreshing."""
+
+
+class InvalidParamsException(StatusException):
+    """Invalid parameters in the request."""
+
+
+class UnauthorizedException(StatusException):
+    """Not authorized to access the data."""
+
+
+class ErrorOccurredException(StatusException):
+    """An error occurred on the Withings side."""
+
+
+class TimeoutException(StatusException):
+    """The request timed out."""
+
+
+class BadStateException(StatusException):
+    """The request could not be handled in the current state."""
+
+
+class TooManyRequestsException(StatusException):
+    """Rate limit exceeded."""
+
+
+class HTTPStatusException(StatusException):
+    """HTTP request failed, status is the HTTP status code."""
+
+
+# status -> exception class, built once so classifying a status is a lookup
+STATUS_EXCEPTIONS = {
+    status: exception
+    for statuses, exception in (
+        (STATUS_AUTH_FAILED, AuthFailedException),
+        (STATUS_INVALID_PARAMS, InvalidParamsException),
+        (STATUS_UNAUTHORIZED, UnauthorizedException),
+        (STATUS_ERROR_OCCURRED, ErrorOccurredException),
+        (STATUS_TIMEOUT, TimeoutException),
+        (STATUS_BAD_STATE, BadStateException),
+        (STATUS_TOO_MANY_REQUESTS, TooManyRequestsException),
+    )
+    for status in statuses
+}
+
+
+def status_exception(status):
+    """Exception for a non-successful status"""
+    return STATUS_EXCEPTIONS.get(status, UnknownStatusException)(status=status)
+
+
+def retry_status(error):
+    """Should a failed request be retried (see RequestScheduler)"""
+    if isinstance(error, HTTPStatusException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (TooManyRequestsException, TimeoutException))
+
+
 @dataclass(frozen=True)
 class WithingsCredentials:
     """Withings API Credentials"""
@@ -312,73 +386,182 @@ class WithingsCredentials:
     expires_in: int = 0
 
 
-@dataclass
-class WithingsMeasureScaleGroup:
-    """Withings Measure Values"""
+class WithingsMeasureGroup:
+    """Immutable Withings measure group
 
-    timestamp: None
-    weight: float = 0.0
-    muscle_mass: float = 0.0
-    bone_mass: float = 0.0
-    fat_mass: float = 0.0
-    fat_free_mass: float = 0.0
-    fat_ratio: float = 0.0
-    hydration: float = 0.0
+    epoch is the measurement time in seconds, timezone the one of the
+    getmeas page it came from (one object shared by the page). MEASURES
+    maps the measure types read to the attributes holding them, measures
+    not in the group are 0."""
 
-    def __init__(self, group, timezone=None):
-        self.from_measure_group(group, timezone)
+    MEASURES = {}
 
-    def from_measure_group(self, group, timezone=None):
-        # Set timestamp
+    __slots__ = ("epoch", "timezone")
+
+    def __init__(self, group, timezone=None):
+        self._from_measure_group(group, timezone)
 
-        self.timestamp = arrow.Arrow.fromtimestamp(group["date"], tzinfo=timezone)
+    def _from_measure_group(self, group, timezone=None):
+        setter = object.__setattr__
+        setter(self, "epoch", group["date"])
+        setter(self, "timezone", timezone)
+        for name in self.MEASURES.values():
+            setter(self, name, 0.0)
 
         for measure in group["measures"]:
-            if measure["type"] == 1:
-                self.weight = self._measure_to_val(measure)
-            if measure["type"] == 76:
-                self.muscle_mass = self._measure_to_val(measure)
-            if measure["type"] == 88:
-                self.bone_mass = self._measure_to_val(measure)
-            if measure["type"] == 8:
-                self.fat_mass = self._measure_to_val(measure)
-            if measure["type"] == 5:
-                self.fat_free_mass = self._measure_to_val(measure)
-            if measure["type"] == 6:
-                self.fat_ratio = self._measure_to_val(measure)
-            if measure["type"] == 77:
-                self.hydration = self._measure_to_val(measure)
+            name = self.MEASURES.get(measure["type"])
+            if name is not None:
+                setter(self, name, self._measure_to_val(measure))
 
     def _measure_to_val(self, measure):
         return float(measure["value"] * pow(10, measure["unit"]))
 
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
 
-@dataclass
-class WithingsMeasureHeightGroup:
+    def __getstate__(self):
+        return {
+            name: getattr(self, name)
+            for cls in type(self).__mro__
+            for name in getattr(cls, "__slots__", ())
+        }
+
+    def __setstate__(self, state):
+        # copy and pickle restore the slots bypassing __setattr__
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    @property
+    def timestamp(self):
+        """Measurement time as an Arrow, created on each access"""
+        return arrow.Arrow.fromtimestamp(self.epoch, tzinfo=self.timezone)
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return (self.epoch, self.timezone, self._values()) == (
+            other.epoch,
+            other.timezone,
+            other._values(),
+        )
+
+    def __hash__(self):
+        return hash((type(self), self.epoch, self._values()))
+
+    def __repr__(self):
+        return "{}(epoch={}, {})".format(
+            type(self).__name__,
+            self.epoch,
+            ", ".join(
+                "{}={}".format(name, getattr(self, name)) for name in self.__slots__
+            ),
+        )
+
+
+class WithingsMeasureScaleGroup(WithingsMeasureGroup):
     """Withings Measure Values"""
 
-    timestamp: None
-    height: float = 0
+    MEASURES = {
+        1: "weight",
+        76: "muscle_mass",
+        88: "bone_mass",
+        8: "fat_mass",
+        5: "fat_free_mass",
+        6: "fat_ratio",
+        77: "hydration",
+    }
 
-    def __init__(self, group, timezone=None):
-        self.from_measure_group(group, timezone)
+    __slots__ = tuple(MEASURES.values())
 
-    def from_measure_group(self, group, timezone=None):
-        # Set timestamp
 
-        self.timestamp = arrow.Arrow.fromtimestamp(group["date"], tzinfo=timezone)
+class WithingsMeasureHeightGroup(WithingsMeasureGroup):
+    """Withings Measure Values"""
 
-        for measure in group["measures"]:
-            if measure["type"] == 4:
-                self.height = self._measure_to_val(measure)
+    MEASURES = {4: "height"}
 
-    def _measure_to_val(self, measure):
-        return float(measure["value"] * pow(10, measure["unit"]))
+    __slots__ = tuple(MEASURES.values())
+
+
+class WithingsMeasureSeries:
+    """Measure groups sorted by time
+
+    Window queries bisect the sorted measurement times."""
+
+    def __init__(self, groups=()):
+        self._groups = sorted(groups, key=lambda group: group.epoch)
+        self._epochs = [group.epoch for group in self._groups]
+
+    def add(self, group):
+        index = bisect_right(self._epochs, group.epoch)
+        self._epochs.insert(index, group.epoch)
+        self._groups.insert(index, group)
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def __getitem__(self, index):
+        return self._groups[index]
+
+    def since(self, timestamp, until=None):
+        """Groups measured after timestamp and up to until"""
+        start = bisect_right(self._epochs, timestamp)
+        stop = len(self._epochs) if until is None else bisect_right(self._epochs, until)
+        return self._groups[start:stop]
+
+    def latest(self):
+        """Most recent group or None"""
+        return self._groups[-1] if self._groups else None
+
+
+class WithingsHeightSeries:
+    """Heights indexed by the time they were measured"""
+
+    def __init__(self, heights):
+        heights = sorted(heights)
+        self._timestamps = [ts for ts, _ in heights]
+        self._heights = [height for _, height in heights]
+
+    @classmethod
+    def from_groups(cls, groups):
+        return cls((g.epoch, g.height) for g in groups)
+
+    def __len__(self):
+        return len(self._heights)
+
+    def height_at(self, timestamp):
+        """Height in effect at timestamp
+
+        Before the first measurement the first height is used."""
+        if not self._heights:
+            raise ValueError("No height measurements")
+        index = bisect_right(self._timestamps, timestamp)
+        return self._heights[max(index - 1, 0)]
+
+    def latest(self):
+        return self.height_at(self._timestamps[-1]) if self._heights else None
+
+    def bmi(self, weight, timestamp):
+        return weight / self.height_at(timestamp) ** 2
 
 
 class WithingsAPI:
-    def __init__(self, credentials, save_callback=None, save_callback_args=None):
+    BASE_URL = "https://wbsapi.withings.net"
+
+    def __init__(
+        self,
+        credentials,
+        save_callback=None,
+        save_callback_args=None,
+        scheduler=None,
+    ):
         self._session = None
+        self._scheduler = scheduler or default_scheduler
         self._scope = ["user.metrics"]
         self._credentials = credentials
         self._save_callback = save_callback
@@ -389,6 +572,8 @@ class WithingsAPI:
             "token_type": self._credentials.token_type,
             "expires_in": self._credentials.expires_in,
         }
+        self._heights = dict()
+        self._heights_fetched = 0
 
     def authenticate(self):
         """Authenticate to withings API"""
@@ -400,7 +585,7 @@ class WithingsAPI:
                 token=self._token,
                 default_token_placement="query",
             ),
-            auto_refresh_url="https://wbsapi.withings.net/v2/oauth2",
+            auto_refresh_url=self.BASE_URL + "/v2/oauth2",
             auto_refresh_kwargs={
                 "action": "requesttoken",
                 "client_id": self._credentials.client_id,
@@ -458,7 +643,7 @@ class WithingsAPI:
         auth_code = redirected_uri_params["code"]
 
         self._session.fetch_token(
-            "https://wbsapi.withings.net/v2/oauth2",
+            self.BASE_URL + "/v2/oauth2",
             include_client_id=True,
             action="requesttoken",
             code=auth_code,
@@ -467,10 +652,15 @@ class WithingsAPI:
         )
 
     def _get_data(self, url, data):
-        """Get data and check response"""
+        """Get data and check response, retrying when rate limited"""
+        return self._scheduler.call(
+            "withings", self._request, url, data, retry_on=retry_status
+        )
+
+    def _request(self, url, data):
         r = self._session.post(url, data=data)
         if r.status_code != 200:
-            raise RuntimeError
+            raise HTTPStatusException(status=r.status_code)
 
         response = r.json()
         status = response.get("status")
@@ -481,38 +671,124 @@ class WithingsAPI:
         if status in STATUS_SUCCESS:
             return response.get("body")
 
-        raise UnknownStatusException(status=status)
-
-    def get_measures(self, lastupdate):
+        raise status_exception(status)
+
+    def _iter_pages(self, data, prefetch=True):
+        """Generator of getmeas response bodies following the offset continuation
+
+        With prefetch the next page is requested on a background thread
+        while the current page is consumed."""
+        url = self.BASE_URL + "/v2/measure"
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = self._get_data(url, data=data)
+            while True:
+                more = page.get("more") and page.get("offset")
+                if more:
+                    data = dict(data, offset=page["offset"])
+                    if executor is not None:
+                        future = executor.submit(self._get_data, url, data=data)
+
+                yield page
+
+                if not more:
+                    break
+                if executor is not None:
+                    page = future.result()
+                else:
+                    page = self._get_data(url, data=data)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def iter_measure_pages(
+        self, start, end=None, meastypes=SCALE_MEASTYPES, prefetch=True
+    ):
+        """Generator of the raw getmeas response bodies
+
+        Without end all groups updated since start are returned, otherwise
+        the groups measured between start and end. Pages are requested as
+        they are consumed following the offset continuation."""
         data = {
             "action": "getmeas",
-            "meastypes": "1,5,6,8,76,77,88",
+            "meastypes": meastypes,
             "category": "1",
-            "lastupdate": lastupdate.int_timestamp,
         }
+        if end is None:
+            data["lastupdate"] = start.int_timestamp
+        else:
+            data["startdate"] = start.int_timestamp
+            data["enddate"] = end.int_timestamp
 
-        response = self._get_data("https://wbsapi.withings.net/v2/measure", data=data)
+        return self._iter_pages(data, prefetch)
 
-        val = list()
-        if "measuregrps" in response:
-            for group in response["measuregrps"]:
-                val.append(WithingsMeasureScaleGroup(group, response["timezone"]))
+    def iter_measures(self, start, end=None, prefetch=True):
+        """Generator of scale measure groups (see iter_measure_pages)"""
+        for page in self.iter_measure_pages(start, end, prefetch=prefetch):
+            for group in page.get("measuregrps", []):
+                yield WithingsMeasureScaleGroup(group, page.get("timezone"))
 
-        return val
+    def get_measures(self, lastupdate):
+        return WithingsMeasureSeries(self.iter_measures(lastupdate))
 
     def get_height(self, lastupdate):
-        data = {
-            "action": "getmeas",
-            "meastype": "4",
-            "category": "1",
-            "lastupdate": lastupdate.int_timestamp,
-        }
+        val = WithingsMeasureSeries()
+        for page in self.iter_measure_pages(lastupdate, meastypes=HEIGHT_MEASTYPES):
+            for group in page.get("measuregrps", []):
+                val.add(WithingsMeasureHeightGroup(group, page.get("timezone")))
+
+        return val
 
-        response = self._get_data("https://wbsapi.withings.net/v2/measure", data=data)
+    def get_height_series(self, store=None, ttl=HEIGHT_TTL):
+        """Height series, refreshed from the API at most every ttl seconds
+
+        Only heights updated since the previous refresh are requested.
+        With a MeasurementStore the heights and the refresh time are
+        persisted in it, otherwise they are cached on this instance."""
+        now = arrow.utcnow().int_timestamp
+
+        if store is not None:
+            fetched = store.get_watermark("withings.height")
+            if now - fetched >= ttl:
+                store.add_pages(
+                    "height",
+                    self.iter_measure_pages(
+                        arrow.get(fetched), meastypes=HEIGHT_MEASTYPES
+                    ),
+                )
+                store.set_watermark("withings.height", now)
+            return WithingsHeightSeries.from_groups(store.groups("height"))
+
+        if now - self._heights_fetched >= ttl:
+            for group in self.get_height(arrow.get(self._heights_fetched)):
+                self._heights[group.epoch] = group.height
+            self._heights_fetched = now
+        return WithingsHeightSeries(self._heights.items())
+
+    def subscribe(self, callbackurl, appli=NOTIFY_APPLI_WEIGHT, comment="SportSync"):
+        """Have Withings notify callbackurl of new measurements
+
+        Withings checks that the URL answers before subscribing it."""
+        return self._get_data(
+            self.BASE_URL + "/notify",
+            data={
+                "action": "subscribe",
+                "callbackurl": callbackurl,
+                "appli": appli,
+                "comment": comment,
+            },
+        )
 
-        val = list()
-        if "measuregrps" in response:
-            for group in response["measuregrps"]:
-                val.append(WithingsMeasureHeightGroup(group, response["timezone"]))
+    def list_subscriptions(self, appli=NOTIFY_APPLI_WEIGHT):
+        """Notification profiles, dicts with callbackurl, comment and expires"""
+        body = self._get_data(
+            self.BASE_URL + "/notify", data={"action": "list", "appli": appli}
+        )
+        return (body or {}).get("profiles", [])
 
-        return val
+    def revoke(self, callbackurl, appli=NOTIFY_APPLI_WEIGHT):
+        """Stop the notifications to callbackurl"""
+        return self._get_data(
+            self.BASE_URL + "/notify",
+            data={"action": "revoke", "callbackurl": callbackurl, "appli": appli},
+        )
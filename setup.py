@@ -70,6 +70,10 @@ setup(
     packages=find_packages(exclude=["tests", ".github"]),
     python_requires=">=3.7, <4",
     install_requires=read_requirements("requirements.txt"),
+    extras_require={
+        "numpy": ["numpy"],
+        "async": ["aiohttp"],
+    },
     # Entry points. The following would provide a command called `sample` which
     # executes the function `main` from this package when invoked:
     entry_points={
@@ -0,0 +1,193 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+import yaml
+
+from SportSync import watch
+from SportSync.config import Dumper
+from SportSync.ratelimit import RequestScheduler
+from SportSync.sync import AccountSync, store_path
+from SportSync.withings import MeasurementStore, WithingsAPI, WithingsCredentials
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-benchmarks", action="store_true", help="run the timing benchmarks"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "benchmark: timing benchmark, skipped without --run-benchmarks"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-benchmarks"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, use --run-benchmarks")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def make_group(grpid, date, weight=80.0):
+    """getmeas measure group with a weight in grams"""
+    return {
+        "grpid": grpid,
+        "date": date,
+        "category": 1,
+        "measures": [{"type": 1, "value": int(weight * 1000), "unit": -3}],
+    }
+
+
+class _FakeWithingsHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, form))
+        if server.delay:
+            time.sleep(server.delay)
+
+        if self.path == "/v2/measure":
+            body = server.getmeas(form)
+        elif self.path == "/notify":
+            body = {"profiles": []} if form.get("action") == "list" else {}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        data = json.dumps({"status": 0, "body": body}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeWithings(ThreadingHTTPServer):
+    """Local Withings API answering getmeas in pages of page_size groups
+
+    requests holds the path and form of every request received."""
+
+    daemon_threads = True
+
+    def __init__(self, groups=(), page_size=2, delay=0.0):
+        super().__init__(("127.0.0.1", 0), _FakeWithingsHandler)
+        self.groups = list(groups)
+        self.page_size = page_size
+        self.delay = delay
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    def getmeas(self, form):
+        if "startdate" in form:
+            start, end = int(form["startdate"]), int(form["enddate"])
+            groups = [g for g in self.groups if start <= g["date"] <= end]
+        else:
+            groups = list(self.groups)
+        offset = int(form.get("offset", 0))
+        page = groups[offset : offset + self.page_size]
+        body = {"measuregrps": page, "timezone": "Europe/London"}
+        if offset + self.page_size < len(groups):
+            body.update(more=1, offset=offset + self.page_size)
+        return body
+
+    def measure_requests(self):
+        with self.lock:
+            return [form for path, form in self.requests if path == "/v2/measure"]
+
+
+@pytest.fixture
+def withings_server():
+    server = FakeWithings()
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def fake_withings_api(server, userid=0):
+    """WithingsAPI talking to a FakeWithings without authenticating"""
+    api = WithingsAPI(
+        WithingsCredentials("id", "secret", "http://localhost/", userid=userid),
+        scheduler=RequestScheduler({"withings": (1000.0, 1000)}),
+    )
+    api.BASE_URL = server.url
+    api._session = requests.Session()
+    return api
+
+
+@pytest.fixture
+def withings_api(withings_server):
+    return fake_withings_api(withings_server)
+
+
+class FakeAccountSync(AccountSync):
+    """AccountSync fetching from a FakeWithings, without Garmin and Strava
+
+    Instances register themselves in accounts by userid, fetches records
+    the fetched windows and sync the number of calls."""
+
+    server = None
+    accounts = {}
+
+    def __init__(self, config, limits=None):
+        self.config = config
+        self._limits = limits
+        self._strava = None
+        self.fetches = []
+        self.syncs = 0
+        self.withings = fake_withings_api(self.server, config["withings"].userid)
+        self.store = MeasurementStore(store_path(config))
+        self.accounts[config["withings"].userid] = self
+
+    def fetch(self, start=None, end=None):
+        self.fetches.append((start, end))
+        return super().fetch(start, end)
+
+    def sync(self, force=False):
+        self.syncs += 1
+
+
+@pytest.fixture
+def fake_accounts(tmp_path, withings_server, monkeypatch):
+    """Write the config files of 4 accounts watched with FakeAccountSync
+
+    Returns the config files, the FakeAccountSync class holds the accounts."""
+    monkeypatch.setattr(FakeAccountSync, "server", withings_server)
+    monkeypatch.setattr(FakeAccountSync, "accounts", {})
+    monkeypatch.setattr(watch, "AccountSync", FakeAccountSync)
+
+    config_files = []
+    for userid in range(1, 5):
+        path = str(tmp_path / "config{}.yml".format(userid))
+        config = {
+            "withings": WithingsCredentials(
+                "id", "secret", "http://localhost/", userid=userid
+            ),
+            "nokia": {},
+        }
+        with open(path, "w") as outfile:
+            yaml.dump(config, outfile, Dumper=Dumper)
+        config_files.append(path)
+    return config_files
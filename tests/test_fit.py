@@ -0,0 +1,231 @@
+import io
+import random
+
+import pytest
+
+from SportSync import fit
+
+from . import baseline_fit
+
+TIMESTAMP = 1700000000
+
+
+@pytest.fixture
+def data():
+    rng = random.Random(1)
+    return bytes(rng.randrange(256) for _ in range(4096))
+
+
+def reference_crc(data, crc=0):
+    for byte in data:
+        crc = fit._calcCRC(crc, byte)
+    return crc
+
+
+def test_crc16(data):
+    assert fit.crc16(data) == reference_crc(data)
+    assert fit.crc16(b"") == 0
+    assert fit.crc16(data[1000:], fit.crc16(data[:1000])) == reference_crc(data)
+
+
+def test_crc16_combine(data):
+    rng = random.Random(2)
+    crc = reference_crc(data)
+    for split in [0, len(data)] + [rng.randrange(len(data)) for _ in range(20)]:
+        crc1 = fit.crc16(data[:split])
+        crc2 = fit.crc16(data[split:])
+        assert fit.crc16_combine(crc1, crc2, len(data) - split) == crc
+
+
+def encode_weight(module):
+    rng = random.Random(3)
+    encoder = module.FitEncoderWeight()
+    encoder.write_file_info(time_created=TIMESTAMP, serial_number=5)
+    encoder.write_file_creator()
+    for n in range(200):
+        encoder.write_device_info(timestamp=TIMESTAMP + n * 3600)
+        encoder.write_weight_scale(
+            timestamp=TIMESTAMP + n * 3600,
+            weight=rng.uniform(50, 120),
+            percent_fat=rng.choice([None, rng.uniform(5, 40)]),
+            percent_hydration=rng.uniform(40, 60),
+            bmi=rng.uniform(18, 30),
+        )
+    encoder.finish()
+    return encoder.getvalue()
+
+
+def encode_blood_pressure(module):
+    encoder = module.FitEncoderBloodPressure()
+    encoder.write_file_info(time_created=TIMESTAMP)
+    encoder.write_file_creator()
+    for n in range(5):
+        encoder.write_device_info(timestamp=TIMESTAMP + n)
+        encoder.write_blood_pressure(
+            timestamp=TIMESTAMP + n,
+            diastolic_blood_pressure=80,
+            systolic_blood_pressure=120,
+            heart_rate=60,
+        )
+    encoder.finish()
+    return encoder.getvalue()
+
+
+def decoded(data):
+    return [(r.global_msg, r.fields) for r in fit.FitDecoder(data).records()]
+
+
+def test_weight_identical_to_baseline():
+    assert encode_weight(fit) == encode_weight(baseline_fit)
+
+
+def weight_columns(n=300):
+    rng = random.Random(5)
+    # gaps of up to a minute, some short enough for compressed timestamps
+    timestamps = []
+    timestamp = TIMESTAMP
+    for _ in range(n):
+        timestamp += rng.choice([1, 5, 31, 32, 60])
+        timestamps.append(timestamp)
+    weights = [rng.uniform(50, 120) for _ in timestamps]
+    fat = [rng.choice([None, rng.uniform(5, 40)]) for _ in timestamps]
+    return timestamps, weights, fat
+
+
+def encode_weight_loop(timestamps, weights, fat):
+    encoder = fit.FitEncoderWeight()
+    for timestamp, weight, percent_fat in zip(timestamps, weights, fat):
+        encoder.write_device_info(timestamp=timestamp)
+        encoder.write_weight_scale(
+            timestamp=timestamp, weight=weight, percent_fat=percent_fat
+        )
+    encoder.finish()
+    return encoder.getvalue()
+
+
+@pytest.mark.parametrize("numpy", [False, True])
+def test_weight_batch_identical_to_loop(monkeypatch, numpy):
+    if numpy:
+        np = pytest.importorskip("numpy")
+    monkeypatch.setattr(fit, "np", np if numpy else None)
+    timestamps, weights, fat = weight_columns()
+
+    encoder = fit.FitEncoderWeight()
+    encoder.write_weight_scale_batch(
+        timestamps[:10], weights[:10], percent_fat=fat[:10]
+    )
+    encoder.write_weight_scale_batch(
+        timestamps[10:], weights[10:], percent_fat=fat[10:]
+    )
+    encoder.finish()
+    assert encoder.getvalue() == encode_weight_loop(timestamps, weights, fat)
+
+    if numpy:
+        # NaN marks the missing values of arrays
+        encoder = fit.FitEncoderWeight()
+        encoder.write_weight_scale_batch(
+            np.array(timestamps),
+            np.array(weights),
+            percent_fat=np.array([np.nan if f is None else f for f in fat]),
+        )
+        encoder.finish()
+        assert encoder.getvalue() == encode_weight_loop(timestamps, weights, fat)
+
+
+class Unseekable(io.RawIOBase):
+    """Write only stream, like a pipe"""
+
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def test_two_pass_identical_to_in_memory():
+    def encode(**kwargs):
+        encoder = fit.FitEncoderWeight(**kwargs)
+        encoder.write_file_info(time_created=TIMESTAMP)
+        encoder.write_file_creator()
+        for timestamp, weight, fat in zip(*weight_columns()):
+            encoder.write_device_info(timestamp=timestamp)
+            encoder.write_weight_scale(
+                timestamp=timestamp, weight=weight, percent_fat=fat
+            )
+        encoder.finish()
+        return encoder
+
+    in_memory = encode().getvalue()
+    counter = encode(stream=fit.FitSizeCounter())
+    stream = Unseekable()
+    encode(stream=stream, data_size=counter.data_size)
+
+    assert bytes(stream.data) == in_memory
+    assert counter.get_size() == len(in_memory)
+
+
+def test_blood_pressure_decodes_as_baseline():
+    # local message types are allocated dynamically, only the records match
+    assert decoded(encode_blood_pressure(fit)) == decoded(
+        encode_blood_pressure(baseline_fit)
+    )
+
+
+def test_registered_message_decodes(monkeypatch):
+    # restore the profiles shared by the decoders afterwards
+    monkeypatch.setattr(fit.FitDecoder, "PROFILE", fit.FitDecoder.PROFILE)
+    monkeypatch.setattr(fit.FitDecoder, "MSG_NAMES", fit.FitDecoder.MSG_NAMES)
+
+    class Encoder(fit.FitEncoder):
+        pass
+
+    Encoder.register_message(
+        "custom",
+        0xFF00,
+        (
+            (253, "timestamp", fit.FitBaseType.uint32, 1),
+            (0, "level", fit.FitBaseType.uint16, 10),
+        ),
+    )
+    encoder = Encoder()
+    encoder.write_message("custom", timestamp=TIMESTAMP, level=12.5)
+    encoder.finish()
+
+    (record,) = fit.FitDecoder(encoder.getvalue()).records()
+    assert record.global_msg == 0xFF00
+    assert record.name == "custom"
+    assert record.fields["level"] == 12.5
+    assert "custom" not in fit.FitEncoder.LAYOUTS
+
+
+def encode_weight_records(compressed_timestamps=False):
+    encoder = fit.FitEncoderWeight(compressed_timestamps=compressed_timestamps)
+    encoder.write_file_info(time_created=TIMESTAMP)
+    encoder.write_file_creator()
+    for timestamp, weight, fat in zip(*weight_columns()):
+        encoder.write_device_info(timestamp=timestamp)
+        encoder.write_weight_scale(timestamp=timestamp, weight=weight, percent_fat=fat)
+    encoder.finish()
+    return encoder.getvalue()
+
+
+def encode_weight_batch(compressed_timestamps=False):
+    timestamps, weights, fat = weight_columns()
+    encoder = fit.FitEncoderWeight(compressed_timestamps=compressed_timestamps)
+    encoder.write_weight_scale_batch(timestamps, weights, percent_fat=fat)
+    encoder.finish()
+    return encoder.getvalue()
+
+
+@pytest.mark.parametrize("encode", [encode_weight_records, encode_weight_batch])
+def test_compressed_timestamps_decode_identically(encode):
+    normal = encode()
+    compressed = encode(compressed_timestamps=True)
+
+    assert len(compressed) < len(normal)
+    assert decoded(compressed) == decoded(normal)
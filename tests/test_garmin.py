@@ -0,0 +1,85 @@
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+garmin = pytest.importorskip("SportSync.garmin", exc_type=ImportError)
+
+from SportSync.activity_cache import ActivityCache  # noqa: E402
+
+
+class FakeClient:
+    def __init__(self, fit=b"fit"):
+        self.fit = fit
+
+    def get_activity_summary(self, activity_id):
+        return {"activityName": "Run", "activityTypeDTO": {"typeKey": "running"}}
+
+    def get_activity_fit(self, activity_id):
+        return self.fit
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.calls = []
+
+    def call(self, service, func, *args, **kwargs):
+        self.calls.append((service, func.__name__))
+        return func(*args, **kwargs)
+
+
+def test_download_is_scheduled(monkeypatch):
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(garmin, "scheduler", scheduler)
+
+    name, kind, fit_file = garmin._download(FakeClient(), 1)
+
+    assert (name, kind, fit_file.read()) == ("Run", "running", b"fit")
+    assert scheduler.calls == [
+        ("garmin", "get_activity_summary"),
+        ("garmin", "get_activity_fit"),
+    ]
+
+
+def test_download_without_fit_file(tmp_path):
+    # manually entered activities have no FIT file
+    with ActivityCache(str(tmp_path)) as cache:
+        name, kind, fit_file = garmin._download(FakeClient(None), 1, cache=cache)
+
+        assert (name, kind, fit_file.read()) == ("Run", "running", b"")
+        assert cache.get(1) is None
+
+
+@pytest.mark.parametrize("fit", [b"fit" * 100, None])
+def test_download_spooled(fit):
+    name, kind, fit_file = garmin._download(FakeClient(fit), 1, spool_size=10)
+
+    assert fit_file.read() == (fit or b"")
+
+
+class FakeGarminClient(FakeClient):
+    def __init__(self, username, password):
+        super().__init__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def list_activities(self):
+        return [
+            (n, datetime.fromtimestamp(1600000000 + n, timezone.utc)) for n in range(5)
+        ]
+
+
+def test_get_activities_closes_cached_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(garmin, "GarminClient", FakeGarminClient)
+    with ActivityCache(str(tmp_path)) as cache:
+        for n in range(3):
+            cache.put(n, "Cached", "running", b"cached")
+
+        activities = garmin.get_activities("user", "password", cache=cache)
+
+    assert sorted(act[2].read() for act in activities) == [b"cached"] * 3 + [b"fit"] * 2
+    assert all(isinstance(act[2], io.BytesIO) for act in activities)
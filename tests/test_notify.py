@@ -0,0 +1,134 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from SportSync.watch import watch
+from SportSync.withings import NotificationServer, WithingsNotification
+
+from .conftest import FakeAccountSync
+
+FORM = {"userid": "2", "appli": "1", "startdate": "1600000000", "enddate": "1600003600"}
+
+
+@pytest.fixture(scope="module")
+def notification_server():
+    server = NotificationServer(("127.0.0.1", 0), None, path="/withings")
+    server.url = "http://{}:{}".format(*server.server_address)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def server(notification_server):
+    notification_server.received = []
+    notification_server.callback = notification_server.received.append
+    return notification_server
+
+
+def received(server, count=1, timeout=5):
+    """Notifications received, the callback runs after the reply"""
+    deadline = time.monotonic() + timeout
+    while len(server.received) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return server.received
+
+
+def test_notification(server):
+    r = requests.post(server.url + "/withings", data=FORM)
+
+    assert r.status_code == 200
+    assert received(server) == [WithingsNotification(2, 1, 1600000000, 1600003600)]
+
+
+def test_notification_query(server):
+    r = requests.post(server.url + "/withings", params=FORM)
+
+    assert r.status_code == 200
+    assert received(server) == [WithingsNotification(2, 1, 1600000000, 1600003600)]
+
+
+@pytest.mark.parametrize(
+    "form", [{}, dict(FORM, startdate="yesterday"), {"userid": "2", "appli": "1"}]
+)
+def test_invalid_notification(server, form):
+    r = requests.post(server.url + "/withings", data=form)
+
+    assert r.status_code == 400
+    assert server.received == []
+
+
+def test_notification_wrong_path(server):
+    r = requests.post(server.url + "/other", data=FORM)
+
+    assert r.status_code == 404
+    assert server.received == []
+
+
+@pytest.mark.parametrize("method", ["HEAD", "GET"])
+def test_callback_check(server, method):
+    # Withings checks the callback URL when subscribing
+    assert requests.request(method, server.url + "/withings").status_code == 200
+
+
+def test_callback_error_is_not_raised(server):
+    def callback(notification):
+        raise RuntimeError("callback failed")
+
+    server.callback = callback
+    assert requests.post(server.url + "/withings", data=FORM).status_code == 200
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_watch_fetches_notified_window(fake_accounts, withings_server):
+    port = free_port()
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch,
+        args=(fake_accounts,),
+        kwargs=dict(
+            workers=4,
+            minimum=60,
+            stop=stop,
+            listen=("127.0.0.1", port),
+            callback_url="https://example.org/withings",
+        ),
+    )
+    thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        accounts = FakeAccountSync.accounts
+        # wait for the first poll of the accounts, the next one is a minute away
+        while len(accounts) < 4 or any(not a.fetches for a in accounts.values()):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        url = "http://127.0.0.1:{}/withings".format(port)
+        assert requests.post(url, data=FORM).status_code == 200
+        while len(accounts[2].fetches) < 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert accounts[2].fetches == [(None, None), (1600000000, 1600003600)]
+    assert all(len(accounts[userid].fetches) == 1 for userid in (1, 3, 4))
+
+    subscribed = [
+        form
+        for path, form in withings_server.requests
+        if path == "/notify" and form["action"] == "subscribe"
+    ]
+    assert len(subscribed) == 4
+    assert {form["callbackurl"] for form in subscribed} == {
+        "https://example.org/withings"
+    }
@@ -0,0 +1,29 @@
+import io
+
+from stravalib.exc import RateLimitExceeded
+
+from SportSync.ratelimit import RequestScheduler
+from SportSync.strava import Strava
+
+
+class RateLimitedClient:
+    """Client whose first upload is rate limited after reading the file"""
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload_activity(self, activity_file, data_type, name=None):
+        self.uploads.append(activity_file.read())
+        if len(self.uploads) == 1:
+            raise RateLimitExceeded("Rate limit exceeded", timeout=0.01)
+        return "uploader"
+
+
+def test_upload_retry_rewinds():
+    strava = Strava({}, scheduler=RequestScheduler({"strava": (1000.0, 1000)}))
+    client = strava._client = RateLimitedClient()
+    fit_file = io.BytesIO(b"header fit data")
+    fit_file.seek(7)
+
+    assert strava.upload(fit_file, "Run") == "uploader"
+    assert client.uploads == [b"fit data", b"fit data"]
@@ -0,0 +1,30 @@
+import os
+
+from SportSync.config import ConfigStore
+from SportSync.sync import store_path
+from SportSync.withings import MeasurementStore
+
+from .conftest import make_group
+
+
+def test_store_per_account(fake_accounts):
+    # the config files share a directory and do not set nokia.store
+    a, b = (ConfigStore.open(path) for path in fake_accounts[:2])
+    assert "store" not in a["nokia"]
+    assert os.path.dirname(store_path(a)) == os.path.dirname(a.path)
+    assert store_path(a) != store_path(b)
+
+    with MeasurementStore(store_path(a)) as store:
+        store.add_pages("scale", [{"measuregrps": [make_group(1, 1600000000)]}])
+        store.set_watermark("withings.scale", 1600000000)
+
+    with MeasurementStore(store_path(b)) as store:
+        assert store.latest("scale") is None
+        assert store.get_watermark("withings.scale") == 0
+
+
+def test_store_setting(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text("nokia:\n  store: shared.db\n")
+
+    assert store_path(ConfigStore(str(path))) == str(tmp_path / "shared.db")
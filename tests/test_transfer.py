@@ -0,0 +1,41 @@
+import pytest
+
+transfer = pytest.importorskip("SportSync.transfer", exc_type=ImportError)
+
+
+class FakeUploader:
+    def __init__(self, polls, activity_id=None, error=None):
+        self.polls = polls
+        self.activity_id = activity_id
+        self.error = error
+        self.is_complete = False
+        self.is_error = False
+
+
+class FakeStrava:
+    def poll(self, uploader):
+        uploader.polls -= 1
+        if uploader.polls == 0:
+            uploader.is_complete = uploader.error is None
+            uploader.is_error = uploader.error is not None
+
+
+def test_poll_uploads():
+    uploads = [
+        ("done", FakeUploader(1, activity_id=1)),
+        ("slow", FakeUploader(3, activity_id=2)),
+        ("failed", FakeUploader(2, error="duplicate")),
+    ]
+    results = transfer.poll_uploads(FakeStrava(), uploads, interval=0)
+
+    assert results == [("done", 1), ("failed", "duplicate"), ("slow", 2)]
+
+
+def test_poll_uploads_timeout():
+    uploads = [("done", FakeUploader(1, activity_id=1)), ("stuck", FakeUploader(-1))]
+    results = transfer.poll_uploads(FakeStrava(), uploads, interval=0.01, timeout=0.1)
+
+    assert results[0] == ("done", 1)
+    name, error = results[1]
+    assert name == "stuck"
+    assert isinstance(error, TimeoutError)
@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+
+import arrow
+
+from SportSync import watch as watch_module
+from SportSync.watch import AccountWatcher, AdaptiveInterval, watch
+
+from .conftest import FakeAccountSync, make_group
+
+
+def test_adaptive_interval_backs_off():
+    interval = AdaptiveInterval(60, 900, recent=3600)
+    now = 10**6
+    assert [interval.update(False, now=now) for _ in range(5)] == [
+        120,
+        240,
+        480,
+        900,
+        900,
+    ]
+    assert interval.update(False, last_measure=now - 10, now=now) == 60
+    assert interval.update(False, now=now) == 120
+    assert interval.update(True) == 60
+
+
+def test_watch_accounts_on_workers(fake_accounts, withings_server, caplog):
+    now = arrow.utcnow().int_timestamp
+    withings_server.groups = [make_group(n, now - 86400 + n) for n in range(5)]
+
+    stop = threading.Event()
+    timer = threading.Timer(1.0, stop.set)
+    timer.start()
+    with caplog.at_level(logging.ERROR):
+        watch(fake_accounts, workers=4, minimum=0.05, maximum=0.1, stop=stop)
+    timer.cancel()
+
+    # the stores were used from the pool threads and closed on this one
+    assert caplog.records == []
+    accounts = FakeAccountSync.accounts
+    assert sorted(accounts) == [1, 2, 3, 4]
+    for account in accounts.values():
+        assert len(account.fetches) > 1
+        assert account.syncs >= 1
+
+
+class FailingClose:
+    def close(self):
+        raise RuntimeError("close failed")
+
+
+def test_watcher_close_does_not_raise(caplog):
+    watcher = AccountWatcher("config.yml")
+    watcher._account = FailingClose()
+    with caplog.at_level(logging.ERROR):
+        watcher.close()
+    assert watcher._account is None
+    assert "Closing config.yml failed" in caplog.text
+
+
+class SlowAccountSync(FakeAccountSync):
+    def sync(self, force=False):
+        super().sync(force)
+        if self.config["withings"].userid == 1:
+            time.sleep(1.0)
+
+
+def test_slow_account_does_not_hold_up_others(fake_accounts, monkeypatch):
+    monkeypatch.setattr(watch_module, "AccountSync", SlowAccountSync)
+
+    stop = threading.Event()
+    timer = threading.Timer(0.8, stop.set)
+    timer.start()
+    watch(fake_accounts, workers=4, minimum=0.05, maximum=0.05, stop=stop)
+    timer.cancel()
+
+    accounts = FakeAccountSync.accounts
+    assert len(accounts[1].fetches) == 1
+    assert all(len(accounts[userid].fetches) > 3 for userid in (2, 3, 4))
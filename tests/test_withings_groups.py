@@ -0,0 +1,39 @@
+import copy
+import pickle
+
+import pytest
+
+from SportSync.withings.withings import (
+    WithingsMeasureHeightGroup,
+    WithingsMeasureScaleGroup,
+)
+
+from .conftest import make_group
+
+GROUPS = [
+    WithingsMeasureScaleGroup(make_group(1, 1600000000, 72.5), "Europe/London"),
+    WithingsMeasureHeightGroup(
+        {"date": 1600000000, "measures": [{"type": 4, "value": 180, "unit": -2}]}
+    ),
+]
+
+
+@pytest.mark.parametrize("group", GROUPS)
+def test_group_is_immutable(group):
+    with pytest.raises(AttributeError):
+        group.epoch = 0
+    assert not hasattr(group, "from_measure_group")
+
+
+@pytest.mark.parametrize(
+    "clone", [copy.copy, copy.deepcopy, lambda g: pickle.loads(pickle.dumps(g))]
+)
+@pytest.mark.parametrize("group", GROUPS)
+def test_group_copies(group, clone):
+    copied = clone(group)
+
+    assert copied == group
+    assert copied is not group
+    assert (copied.epoch, copied.timezone) == (group.epoch, group.timezone)
+    with pytest.raises(AttributeError):
+        copied.epoch = 0
@@ -0,0 +1,59 @@
+import time
+
+import arrow
+import pytest
+
+from .conftest import make_group
+
+START = 1600000000
+
+
+@pytest.fixture
+def groups(withings_server):
+    withings_server.groups = [make_group(n, START + n * 3600, 70 + n) for n in range(7)]
+    return withings_server.groups
+
+
+def test_pages_follow_offset(withings_api, withings_server, groups):
+    pages = list(withings_api.iter_measure_pages(arrow.get(START)))
+
+    assert [len(page["measuregrps"]) for page in pages] == [2, 2, 2, 1]
+    assert [g for page in pages for g in page["measuregrps"]] == groups
+    offsets = [form.get("offset") for form in withings_server.measure_requests()]
+    assert offsets == [None, "2", "4", "6"]
+
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_iter_measures(withings_api, groups, prefetch):
+    measures = list(withings_api.iter_measures(arrow.get(START), prefetch=prefetch))
+
+    assert [m.epoch for m in measures] == [g["date"] for g in groups]
+    assert [m.weight for m in measures] == [70.0 + n for n in range(7)]
+    assert {m.timezone for m in measures} == {"Europe/London"}
+
+
+def test_measure_window(withings_api, withings_server, groups):
+    start, end = arrow.get(START + 3600), arrow.get(START + 4 * 3600)
+    measures = list(withings_api.iter_measures(start, end))
+
+    assert [m.epoch for m in measures] == [g["date"] for g in groups[1:5]]
+    form = withings_server.measure_requests()[0]
+    assert "lastupdate" not in form
+    assert (form["startdate"], form["enddate"]) == (
+        str(start.int_timestamp),
+        str(end.int_timestamp),
+    )
+
+
+@pytest.mark.parametrize("prefetch, requested", [(True, 2), (False, 1)])
+def test_prefetch_next_page(withings_api, withings_server, groups, prefetch, requested):
+    withings_server.delay = 0.05
+    pages = withings_api.iter_measure_pages(arrow.get(START), prefetch=prefetch)
+
+    next(pages)
+    # the next page is requested while the first one is consumed
+    time.sleep(0.2)
+    assert len(withings_server.measure_requests()) == requested
+
+    pages.close()
+    assert len(withings_server.measure_requests()) == requested
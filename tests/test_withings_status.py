@@ -0,0 +1,84 @@
+import timeit
+
+import pytest
+
+from SportSync.withings import withings
+from SportSync.withings.withings import (
+    AuthFailedException,
+    BadStateException,
+    ErrorOccurredException,
+    HTTPStatusException,
+    InvalidParamsException,
+    StatusException,
+    TimeoutException,
+    TooManyRequestsException,
+    UnauthorizedException,
+    UnknownStatusException,
+    retry_status,
+    status_exception,
+)
+
+STATUSES = [
+    (withings.STATUS_AUTH_FAILED, AuthFailedException),
+    (withings.STATUS_INVALID_PARAMS, InvalidParamsException),
+    (withings.STATUS_UNAUTHORIZED, UnauthorizedException),
+    (withings.STATUS_ERROR_OCCURRED, ErrorOccurredException),
+    (withings.STATUS_TIMEOUT, TimeoutException),
+    (withings.STATUS_BAD_STATE, BadStateException),
+    (withings.STATUS_TOO_MANY_REQUESTS, TooManyRequestsException),
+]
+
+
+@pytest.mark.parametrize("statuses, exception", STATUSES)
+def test_status_exception(statuses, exception):
+    for status in statuses:
+        error = status_exception(status)
+        assert type(error) is exception
+        assert error.status == status
+
+
+def test_unknown_status():
+    known = {status for statuses, _ in STATUSES for status in statuses}
+    for status in set(range(11000)) - known:
+        assert type(status_exception(status)) is UnknownStatusException
+    assert issubclass(UnknownStatusException, StatusException)
+
+
+def test_retry_status():
+    assert retry_status(TooManyRequestsException(601))
+    assert retry_status(TimeoutException(522))
+    assert retry_status(HTTPStatusException(429))
+    assert retry_status(HTTPStatusException(503))
+    assert not retry_status(HTTPStatusException(404))
+    assert not retry_status(AuthFailedException(401))
+    assert not retry_status(ValueError())
+
+
+def scan_exception(status):
+    """Classification by scanning the tuples, as before the lookup table"""
+    for statuses, exception in STATUSES:
+        if status in statuses:
+            return exception(status=status)
+    return UnknownStatusException(status=status)
+
+
+def test_status_lookup_matches_scan():
+    for status in range(11000):
+        assert type(status_exception(status)) is type(scan_exception(status))
+
+
+@pytest.mark.benchmark
+def test_status_lookup_benchmark():
+    statuses = range(11000)
+
+    def classify(func):
+        for status in statuses:
+            func(status)
+
+    lookup = min(timeit.repeat(lambda: classify(status_exception), number=1, repeat=5))
+    scan = min(timeit.repeat(lambda: classify(scan_exception), number=1, repeat=5))
+    print(
+        "status lookup {:.2f} us, scan {:.2f} us".format(
+            lookup / len(statuses) * 1e6, scan / len(statuses) * 1e6
+        )
+    )
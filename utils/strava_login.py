@@ -1,22 +1,11 @@
-import yaml
 from urllib import parse
 from stravalib.client import Client
 
-
-def get_config():
-    with open("config.yml") as c:
-        config = yaml.load(c, Loader=yaml.FullLoader)
-
-    return config
-
-
-def write_config(config):
-    with open("config.yml", "w") as outfile:
-        yaml.dump(config, outfile, default_flow_style=False)
+from SportSync.config import ConfigStore
 
 
 def login():
-    config = get_config()
+    config = ConfigStore("config.yml")
 
     client = Client()
 
@@ -48,7 +37,8 @@ def login():
     )
 
     config["strava"].update(access_token)
-    write_config(config)
+    config.mark_dirty("strava")
+    config.save()
 
 
 if __name__ == "__main__":